@@ -0,0 +1,154 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: benchmark.py: performance benchmarks of the data loader and the XEMM engine                 -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+Every case writes a seeded synthetic orderbooks file (data.synthetic_jsonOB) and, in a fresh process,
+times read_jsonOB, the alignment the engine walks (to_columns and the iter_columns cursor) and
+cross_exchange_market_making over the aligned columns separately, reporting seconds, snapshots/sec and the peak resident memory after each phase. A recorded file can
+be benchmarked instead (--file), and each case is run with the order arrivals going through the
+vectorized batch path and/or the sequential kernel (compiled when numba is installed).
+
+Example:
+    python benchmark.py --snapshots 100 1000 --depth 100 --volatility 5 --output benchmark.json
+    python benchmark.py --file orderbooks_05jul21.json --kernel batch kernel --repeat 3
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import data as dt
+import functions
+from functions import XEMM
+
+
+def _peak_rss_mb() -> float:
+    # peak resident set size of this process (None where the resource module is unavailable)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_case(file_name: str, file_dir: str, kernel: str = None) -> list:
+    """
+    Times each phase of one XEMM run over an orderbooks file (meant to run in its own process, so
+    the peak memory belongs to the case). kernel is 'batch' or 'kernel' to choose how the order
+    arrivals are processed (default = functions.USE_KERNEL).
+    """
+    warnings.filterwarnings('ignore')
+    if kernel is not None:
+        functions.USE_KERNEL = kernel == 'kernel'
+    phases = []
+
+    def timed(phase, func, n_snapshots=None):
+        start = perf_counter()
+        out = func()
+        seconds = perf_counter() - start
+        phases.append({'phase': phase, 'seconds': seconds, 'peak_rss_mb': _peak_rss_mb(),
+                       'snapshots_per_sec': n_snapshots / seconds if n_snapshots and seconds else None})
+        return out
+
+    ob_krak, ob_bit = timed('read_jsonOB', lambda: dt.read_jsonOB(file_name, file_dir))
+    n_snapshots = len(ob_krak)
+    phases[-1]['snapshots_per_sec'] = n_snapshots / phases[-1]['seconds']
+
+    # same alignment as XEMM._snapshot_pairs: columns built once, then walked with the as-of cursor
+    origin, dest = timed('to_columns', lambda: (dt.to_columns(ob_krak.items()), dt.to_columns(ob_bit.items())),
+                         n_snapshots)
+    timed('iter_columns', lambda: sum(1 for _ in dt.iter_columns(origin, dest)), n_snapshots)
+    if functions.USE_KERNEL and functions.HAS_NUMBA:
+        # compile (or load from the numba cache) outside of the timed run
+        timed('jit_compile', lambda: XEMM(ob_krak=dict(itertools.islice(ob_krak.items(), 20)),
+                                          ob_bit=ob_bit).cross_exchange_market_making())
+    xemm = XEMM(snapshots=dt.iter_columns(origin, dest))
+    timed('cross_exchange_market_making', xemm.cross_exchange_market_making, n_snapshots)
+    return phases
+
+
+def _run_cases(file_name: str, file_dir: str, case: dict, kernels: list, repeat: int) -> list:
+    rows = []
+    for kernel, run in itertools.product(kernels, range(repeat)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            phases = executor.submit(run_case, file_name, file_dir, kernel).result()
+        rows.extend({**case, 'kernel': kernel, 'numba': functions.HAS_NUMBA, 'run': run, **phase}
+                    for phase in phases)
+    return rows
+
+
+def benchmark(snapshots: list, depths: list, volatilities: list, seed: int = 0, repeat: int = 1,
+              kernels: list = (None,), file_name: str = None, file_dir: str = None) -> pd.DataFrame:
+    """
+    Runs every combination of snapshot count, origin depth and volatility (or the given orderbooks
+    file) with every order arrival path, each repetition in a fresh process.
+
+    Returns:
+    --------
+        One row per case, arrival path, repetition and phase (pd.DataFrame).
+    """
+    if file_name is not None:
+        return pd.DataFrame(_run_cases(file_name, file_dir, {'file': file_name}, kernels, repeat))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as file_dir:
+        for n_snapshots, depth, volatility in itertools.product(snapshots, depths, volatilities):
+            file_name = f'synthetic_{n_snapshots}_{depth}_{volatility}.json'
+            orderbooks = dt.synthetic_jsonOB(n_snapshots, depth, volatility=volatility, seed=seed)
+            with open(os.path.join(file_dir, file_name), 'w') as f:
+                json.dump(orderbooks, f)
+
+            case = {'snapshots': n_snapshots, 'depth': depth, 'volatility': volatility, 'seed': seed}
+            rows.extend(_run_cases(file_name, file_dir, case, kernels, repeat))
+
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the data loader and the XEMM engine.')
+    parser.add_argument('--snapshots', type=int, nargs='+', default=[100, 1000], help='origin snapshots per case')
+    parser.add_argument('--depth', type=int, nargs='+', default=[100], help='origin levels per side')
+    parser.add_argument('--volatility', type=float, nargs='+', default=[5.], help='origin mid-price volatility')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic orderbooks')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case')
+    parser.add_argument('--kernel', nargs='+', choices=['batch', 'kernel'], default=['batch', 'kernel'],
+                        help='order arrival paths to compare (kernel is compiled when numba is installed)')
+    parser.add_argument('--file', default=None, help='orderbooks file benchmarked instead of synthetic ones')
+    parser.add_argument('--file_dir', default=None, help='directory of the file (default: current folder)')
+    parser.add_argument('--output', default='benchmark.json', help='json file for the results')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.snapshots, args.depth, args.volatility, args.seed, args.repeat,
+                        args.kernel, args.file, args.file_dir)
+    print(results.to_string(index=False))
+
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    machine = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+               'numba': numba_version,
+               'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+    with open(args.output, 'w') as f:
+        json.dump({'machine': machine, 'results': results.to_dict(orient='records')}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
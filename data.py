@@ -9,7 +9,42 @@
 """
 
 import pandas as pd
-import os, sys, json
+import numpy as np
+import os, sys, json, hashlib, shutil
+from typing import NamedTuple
+
+
+# tick sizes of the captured exchanges (USD per BTC)
+TICK_SIZES = {'kraken': .1, 'bitfinex': 1.}
+
+
+class Snapshot(NamedTuple):
+    """
+    Orderbook snapshot as compact arrays, levels ordered from the top of the book.
+    """
+    bid: np.ndarray
+    bid_size: np.ndarray
+    ask: np.ndarray
+    ask_size: np.ndarray
+
+
+class Deltas(NamedTuple):
+    """
+    Level changes of an orderbook update: new size of every level that changed, nan when it was
+    removed (see to_deltas).
+    """
+    price: np.ndarray
+    size: np.ndarray
+    is_bid: np.ndarray
+
+
+def _file_path(file_name: str, file_dir: str = None) -> str:
+    # obtain file directory if left unspecified
+    if file_dir==None:
+        abs_dir = os.path.join(os.path.abspath('.'), 'files')
+        sys.path.insert(0,abs_dir)
+        file_dir = abs_dir
+    return os.path.join(file_dir, file_name)
 
 def read_jsonOB(file_name:str, file_dir:str = None):
     """
@@ -45,19 +80,13 @@ def read_jsonOB(file_name:str, file_dir:str = None):
     
     """
     
-    # obtain file directory if left unspecified
-    if file_dir==None:
-        abs_dir = os.path.abspath('.')+'\\files'
-        sys.path.insert(0,abs_dir)
-        file_dir = abs_dir
-    
     # read JSON object
-    f = open(file_dir+"\\"+file_name)
+    with open(_file_path(file_name, file_dir)) as f:
+
+        # return JSON object as dictionary
+        orderbooks_data = json.load(f)
 
     # Origin exchange
-        
-    # return JSON object as dictionary
-    orderbooks_data = json.load(f)
     ob_origin = orderbooks_data['kraken']  # select specific exchange
     
     # drop None keys
@@ -82,6 +111,966 @@ def read_jsonOB(file_name:str, file_dir:str = None):
     
     return ob_origin, ob_dest
 
+class _JsonStream:
+    """
+    Minimal incremental reader of a JSON document: values are decoded one at a time from a buffer
+    that is refilled in chunks, so only the value being decoded is held in memory.
+    """
+    def __init__(self, file_path: str, chunk_size: int = 1 << 20):
+        self.file = open(file_path)
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf, self.pos, self.eof = '', 0, False
+
+    def _refill(self) -> bool:
+        chunk = self.file.read(self.chunk_size)
+        self.buf, self.pos = self.buf[self.pos:] + chunk, 0
+        self.eof = chunk == ''
+        return not self.eof
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._refill():
+                return self.buf[self.pos:self.pos+1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in JSON stream, found '{self.peek()}'")
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a value ending with the buffer might be truncated (e.g. a number)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._refill()
+
+    def keys(self):
+        # yields the keys of the object at the current position, the caller reads each value
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.decode()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.expect(',')
+        self.expect('}')
+
+    def close(self):
+        self.file.close()
+
+
+def _exchanges(file_path: str) -> list:
+    """
+    Names of the exchanges in the file (top-level keys), read without holding the orderbooks.
+    """
+    stream = _JsonStream(file_path)
+    try:
+        names = []
+        for name in stream.keys():
+            names.append(name)
+            for _ in stream.keys():
+                stream.decode()
+        return names
+    finally:
+        stream.close()
+
+
+def _iter_exchange(file_path: str, exchange: str):
+    """
+    Yields (timestamp, value) pairs of the given exchange without reading the rest of the file.
+    """
+    stream = _JsonStream(file_path)
+    try:
+        for name in stream.keys():
+            if name != exchange:
+                # skip other exchanges one snapshot at a time
+                for _ in stream.keys():
+                    stream.decode()
+                continue
+            for timestamp in stream.keys():
+                yield timestamp, stream.decode()
+            return
+    finally:
+        stream.close()
+
+
+def _timestamp(timestamp: str) -> np.datetime64:
+    return np.datetime64(timestamp.rstrip('Z'), 'ns')
+
+
+def timestamp_index(keys) -> np.ndarray:
+    """
+    Parses orderbook keys (ISO 8601 timestamps) into an int64 array of nanoseconds since epoch.
+    """
+    return np.array([key.rstrip('Z') for key in keys], dtype='datetime64[ns]').astype(np.int64)
+
+
+def to_timestamp(key: str) -> int:
+    """
+    Parses a single orderbook key into nanoseconds since epoch.
+    """
+    return int(_timestamp(key).astype(np.int64))
+
+
+def asof_alignment(origin_ts: np.ndarray, dest_ts: np.ndarray) -> tuple:
+    """
+    Pairs each origin snapshot with the latest destination snapshot at or before it (as-of merge).
+
+    Parameters
+    ----------
+
+    origin_ts:np.ndarray
+        Sorted int64 timestamps of the origin snapshots (see timestamp_index).
+
+    dest_ts:np.ndarray
+        Sorted int64 timestamps of the destination snapshots.
+
+
+    Returns
+    -------
+
+    origin_idx:np.ndarray
+        Positions of the origin snapshots with a destination state (those previous to the first
+        destination snapshot are left out).
+
+    dest_idx:np.ndarray
+        Position of the destination snapshot paired with each of them.
+
+    """
+    dest_idx = np.searchsorted(dest_ts, origin_ts, side='right') - 1
+    origin_idx = np.flatnonzero(dest_idx >= 0)
+    return origin_idx, dest_idx[origin_idx]
+
+
+def dest_updates(dest_idx: np.ndarray) -> np.ndarray:
+    """
+    First destination snapshot of every origin tick given the destination paired with each one
+    (asof_alignment): tick n carries the destination updates [start[n], dest_idx[n]], those since the
+    previous tick, and the first tick only the snapshot it is paired with.
+    """
+    return np.concatenate([dest_idx[:1], dest_idx[:-1] + 1])
+
+
+def _column(values) -> np.ndarray:
+    values = values.values() if isinstance(values, dict) else values
+    return np.array(list(values), dtype=float)
+
+
+def to_snapshot(ob) -> Snapshot:
+    """
+    Converts an orderbook (pandas DataFrame or JSON object with 'bid_size', 'bid', 'ask', 'ask_size')
+    into a Snapshot of compact arrays.
+    """
+    if isinstance(ob, pd.DataFrame):
+        return Snapshot(*(ob[col].to_numpy(dtype=float) for col in Snapshot._fields))
+    return Snapshot(*(_column(ob[col]) for col in Snapshot._fields))
+
+
+def iter_jsonOB(file_name:str, file_dir:str = None):
+    """
+    Lazily reads the orderbooks file with an incremental JSON parser, yielding aligned origin and
+    destination snapshots one at a time instead of loading the whole file.
+    Each origin snapshot comes with every destination snapshot since the previous one up to the
+    latest at or before it (as-of alignment, see asof_alignment and dest_updates); origin snapshots
+    previous to the first destination one are skipped.
+
+    Parameters
+    ----------
+
+    file_name:str
+        String indicating the name of the file to be read. (must include '.json')
+
+    file_dir:str (default: None)
+        String indicating the directory where the file is saved.
+        If left unspecified, file's directory is assumed to be in current folder.
+
+
+    Returns
+    -------
+
+    Generator of (origin_timestamp, origin_snapshot, dest_timestamps, dest_snapshots) tuples, where
+    the snapshots are Snapshot arrays of the origin (kraken) and destination (bitfinex) exchanges and
+    the destination ones come as lists (empty when the destination did not change).
+
+    """
+
+    file_path = _file_path(file_name, file_dir)
+
+    # drop None keys
+    origin = ((ts, ob) for ts, ob in _iter_exchange(file_path, 'kraken') if ob is not None)
+    dest = ((ts, ob) for ts, ob in _iter_exchange(file_path, 'bitfinex') if ob is not None)
+
+    # as-of merge of both streams, holding only the destination snapshots since the previous origin one
+    pending, started, upcoming = [], False, next(dest, None)
+    for origin_ts, origin_ob in origin:
+        timestamp = _timestamp(origin_ts)
+        while upcoming is not None and _timestamp(upcoming[0]) <= timestamp:
+            pending.append(upcoming)
+            upcoming = next(dest, None)
+        if not started:
+            if not pending:
+                continue
+            pending, started = pending[-1:], True
+        yield (origin_ts, to_snapshot(origin_ob), [ts for ts, _ in pending],
+               [to_snapshot(ob) for _, ob in pending])
+        pending = []
+
+
+_COLUMNS = ('key', 'timestamp', 'offsets', 'level') + Snapshot._fields
+_CACHE_VERSION = 2
+
+
+def to_columns(items) -> dict:
+    """
+    Stacks the snapshots of an exchange into flat columnar arrays, materialized once so the
+    simulation can walk them with zero-copy views (see snapshot_at and iter_columns).
+
+    Parameters
+    ----------
+
+    items:iterable
+        Ordered (timestamp, orderbook) pairs, e.g. dict.items() of read_jsonOB output. Orderbooks
+        may be DataFrames, JSON objects or Snapshots; None orderbooks are dropped.
+
+
+    Returns
+    -------
+
+    columns:dict
+        'key' (timestamps as str), 'timestamp' (int64 ns), 'offsets' (where each snapshot starts, plus
+        the total number of rows) and flat 'level', 'bid', 'bid_size', 'ask', 'ask_size' arrays, the
+        shorter side of each snapshot padded with nan.
+
+    """
+    keys, offsets, columns = [], [0], {col: [] for col in ('level',) + Snapshot._fields}
+    for ts, ob in items:
+        if ob is None:
+            continue
+        snapshot = ob if isinstance(ob, Snapshot) else to_snapshot(ob)
+        n_levels = max(len(snapshot.bid), len(snapshot.ask))
+        keys.append(ts)
+        offsets.append(offsets[-1] + n_levels)
+        columns['level'].append(np.arange(n_levels, dtype=np.int32))
+        for col, values in zip(Snapshot._fields, snapshot):
+            padded = np.full(n_levels, np.nan)
+            padded[:len(values)] = values
+            columns[col].append(padded)
+
+    columns = {col: np.concatenate(values) if keys else np.empty(0, dtype=np.int32 if col == 'level' else float)
+               for col, values in columns.items()}
+    return {'key': np.array(keys, dtype=str), 'timestamp': timestamp_index(keys),
+            'offsets': np.array(offsets, dtype=np.int64), **columns}
+
+
+def snapshot_at(columns: dict, i: int) -> Snapshot:
+    """
+    Zero-copy view of the i-th snapshot of an exchange stored as columns (to_columns, read_cacheOB).
+    """
+    lo, hi = columns['offsets'][i], columns['offsets'][i+1]
+    return Snapshot(*(columns[col][lo:hi] for col in Snapshot._fields))
+
+
+def top_of_book(columns: dict) -> tuple:
+    """
+    Best bid and ask of every snapshot of an exchange stored as columns (to_columns, read_cacheOB),
+    read in one pass without building the snapshots (nan for a missing side).
+    """
+    start, end = columns['offsets'][:-1], columns['offsets'][1:]
+    if not len(columns['bid']):
+        return np.full(len(start), np.nan), np.full(len(start), np.nan)
+    first = np.minimum(start, len(columns['bid']) - 1)
+    empty = start == end
+    return np.where(empty, np.nan, columns['bid'][first]), np.where(empty, np.nan, columns['ask'][first])
+
+
+def iter_columns(origin: dict, dest: dict):
+    """
+    Cursor over two exchanges stored as columns: yields the as-of aligned (origin_timestamp,
+    origin_snapshot, dest_timestamps, dest_snapshots) tuples as zero-copy views, with every destination
+    update since the previous origin snapshot (dest_updates), so each step costs the same regardless of
+    the number of snapshots.
+    """
+    origin_idx, dest_idx = asof_alignment(origin['timestamp'], dest['timestamp'])
+    for i, start, j in zip(origin_idx, dest_updates(dest_idx), dest_idx):
+        yield (str(origin['key'][i]), snapshot_at(origin, i), [str(dest['key'][k]) for k in range(start, j + 1)],
+               [snapshot_at(dest, k) for k in range(start, j + 1)])
+
+
+def iter_venues(origins: dict, dest: dict):
+    """
+    Cursor over several origin exchanges and one destination stored as columns: yields the updates
+    of every origin in time order, each as-of aligned with the destination, as (origin_timestamp,
+    origin_snapshot, dest_timestamps, dest_snapshots, origin_venue) tuples of zero-copy views, with
+    every destination update since the previous origin update (dest_updates).
+    """
+    venues = list(origins)
+    timestamp = np.concatenate([origins[venue]['timestamp'] for venue in venues])
+    venue = np.repeat(np.arange(len(venues)), [len(origins[venue]['timestamp']) for venue in venues])
+    row = np.concatenate([np.arange(len(origins[venue]['timestamp'])) for venue in venues])
+    order = np.argsort(timestamp, kind='stable')
+    timestamp, venue, row = timestamp[order], venue[order], row[order]
+
+    origin_idx, dest_idx = asof_alignment(timestamp, dest['timestamp'])
+    for k, start, j in zip(origin_idx, dest_updates(dest_idx), dest_idx):
+        origin, i = origins[venues[venue[k]]], row[k]
+        yield (str(origin['key'][i]), snapshot_at(origin, i), [str(dest['key'][d]) for d in range(start, j + 1)],
+               [snapshot_at(dest, d) for d in range(start, j + 1)], venues[venue[k]])
+
+
+def to_deltas(columns: dict) -> dict:
+    """
+    Turns the snapshots of an exchange stored as columns (to_columns, read_cacheOB) into per-level
+    delta events, in one vectorized pass: every level whose size changed from the previous snapshot
+    (new size, or nan when it disappeared). The first snapshot is all deltas from an empty book.
+
+    Returns
+    -------
+
+    deltas:dict
+        'key', 'timestamp' (as in the columns), 'offsets' (where the deltas of each snapshot start,
+        plus the total number of deltas) and flat 'price', 'size', 'is_bid' arrays.
+
+    """
+    offsets = np.asarray(columns['offsets'])
+    n_snapshots = len(offsets) - 1
+    snapshot = np.repeat(np.arange(n_snapshots), np.diff(offsets))
+
+    # levels of every snapshot (A) and the same levels one snapshot later (B)
+    parts = [(snapshot, is_bid, np.asarray(columns[side]), np.asarray(columns[side + '_size']))
+             for is_bid, side in ((True, 'bid'), (False, 'ask'))]
+    t = np.concatenate([np.concatenate([snap, snap + 1]) for snap, _, _, _ in parts])
+    bid = np.concatenate([np.full(2*len(snap), is_bid) for snap, is_bid, _, _ in parts])
+    price = np.concatenate([np.concatenate([p, p]) for _, _, p, _ in parts])
+    size = np.concatenate([np.concatenate([v, v]) for _, _, _, v in parts])
+    later = np.concatenate([np.repeat([False, True], len(snap)) for snap, _, _, _ in parts])
+    valid = ~np.isnan(price) & (t < n_snapshots)
+    t, bid, price, size, later = t[valid], bid[valid], price[valid], size[valid], later[valid]
+
+    # a level of a snapshot is followed by the same level of the previous one, when it had it
+    order = np.lexsort((later, price, ~bid, t))
+    t, bid, price, size, later = t[order], bid[order], price[order], size[order], later[order]
+    pair = (t[1:] == t[:-1]) & (bid[1:] == bid[:-1]) & (price[1:] == price[:-1])
+    paired_next = np.append(pair, False)
+    paired_prev = np.insert(pair, 0, False)
+    changed = ~later & (~paired_next | (size != np.roll(size, -1)))
+    removed = later & ~paired_prev
+    delta = changed | removed
+
+    t = t[delta]
+    return {'key': np.asarray(columns['key']), 'timestamp': np.asarray(columns['timestamp']),
+            'offsets': np.searchsorted(t, np.arange(n_snapshots + 1)).astype(np.int64),
+            'price': price[delta], 'size': np.where(removed[delta], np.nan, size[delta]), 'is_bid': bid[delta]}
+
+
+def deltas_between(deltas: dict, start: int, stop: int) -> Deltas:
+    """
+    Net level changes from snapshot start - 1 to snapshot stop - 1 of an exchange stored as deltas:
+    the last change of every level within the snapshots [start, stop).
+    """
+    lo, hi = deltas['offsets'][start], deltas['offsets'][stop]
+    price, size, is_bid = deltas['price'][lo:hi], deltas['size'][lo:hi], deltas['is_bid'][lo:hi]
+    if stop - start > 1:
+        # the last occurrence of each level wins
+        _, last = np.unique(np.rec.fromarrays([is_bid[::-1], price[::-1]]), return_index=True)
+        last = np.sort(len(price) - 1 - last)
+        price, size, is_bid = price[last], size[last], is_bid[last]
+    return Deltas(price, size, is_bid)
+
+
+def splice_levels(buffers: list, lo: int, hi: int, key: np.ndarray, values: list) -> tuple:
+    """
+    Sets levels in place in buffers kept sorted by key between lo and hi (the first buffer holds the
+    keys, the others the values of the levels): levels already there take the given values, the
+    others are inserted in order and the ones whose first value is nan are removed. Only the span
+    between the first and last removed or inserted level is rebuilt, and the shorter part of the
+    buffers beyond it (head or tail) is moved into the free slots, which must hold len(key) levels at
+    both ends. The keys must be ascending and unique. Returns the new (lo, hi).
+    """
+    live = buffers[0][lo:hi]
+    pos = live.searchsorted(key)
+    exists = live.take(pos, mode='clip') == key if hi > lo else np.zeros(len(key), dtype=bool)
+    gone = np.isnan(values[0])
+    update = exists & ~gone
+    at = lo + pos[update]
+    for buf, vals in zip(buffers[1:], values):
+        buf[at] = vals[update]
+    changed = exists == gone
+    if not changed.any():
+        return lo, hi
+
+    # span [a, b) holding every removed level and insertion point (keys ascending: the last change
+    # is the deepest one)
+    pos, removed = pos[changed], exists[changed]
+    a, b = lo + int(pos[0]), lo + int(pos[-1]) + int(removed[-1])
+    kept = np.ones(b - a, dtype=bool)
+    kept[pos[removed] - (a - lo)] = False
+    new = ~removed
+    new_key = key[changed][new]
+    slot = buffers[0][a:b][kept].searchsorted(new_key) + np.arange(len(new_key))
+    is_new = np.zeros(b - a - int(removed.sum()) + len(new_key), dtype=bool)
+    is_new[slot] = True
+    span = []
+    for buf, vals in zip(buffers, [key] + list(values)):
+        levels = np.empty(len(is_new), dtype=buf.dtype)
+        levels[is_new] = vals[changed][new]
+        levels[~is_new] = buf[a:b][kept]
+        span.append(levels)
+
+    shift = len(is_new) - (b - a)
+    if a - lo < hi - b:
+        for buf in buffers:
+            buf[lo-shift:a-shift] = buf[lo:a]
+        lo, a = lo - shift, a - shift
+    else:
+        for buf in buffers:
+            buf[b+shift:hi+shift] = buf[b:hi]
+        hi += shift
+    for buf, levels in zip(buffers, span):
+        buf[a:a+len(levels)] = levels
+    return lo, hi
+
+
+class DeltaBook:
+    """
+    Live orderbook of an exchange rebuilt from its deltas: bids kept as ascending -price and asks as
+    ascending price, so both sides start at the top of the book, in buffers with free slots at both
+    ends where the changed levels are spliced in place (splice_levels).
+
+    Methods:
+    --------
+        --apply: applies the level changes of an update (Deltas).
+        --snapshot: current book as a Snapshot.
+    """
+    __slots__ = ('_key', '_size', '_bounds')
+
+    def __init__(self):
+        self._key = {True: np.empty(8), False: np.empty(8)}
+        self._size = {True: np.empty(8), False: np.empty(8)}
+        self._bounds = {True: (4, 4), False: (4, 4)}
+
+    def apply(self, deltas: Deltas):
+        for is_bid, sign in ((True, -1.), (False, 1.)):
+            rows = deltas.is_bid == is_bid
+            if not rows.any():
+                continue
+            key, size = sign*deltas.price[rows], deltas.size[rows]
+            order = np.argsort(key, kind='stable')
+            self._reserve(is_bid, len(key))
+            buffers = [self._key[is_bid], self._size[is_bid]]
+            self._bounds[is_bid] = splice_levels(buffers, *self._bounds[is_bid], key[order], [size[order]])
+
+    def _reserve(self, is_bid: bool, n: int):
+        lo, hi = self._bounds[is_bid]
+        if lo >= n and len(self._key[is_bid]) - hi >= n:
+            return
+        capacity = 2*(hi - lo) + 2*n + 8
+        start = (capacity - (hi - lo)) // 2
+        for buffers in (self._key, self._size):
+            buf = np.empty(capacity)
+            buf[start:start+hi-lo] = buffers[is_bid][lo:hi]
+            buffers[is_bid] = buf
+        self._bounds[is_bid] = (start, start + hi - lo)
+
+    def _side(self, is_bid: bool) -> tuple:
+        lo, hi = self._bounds[is_bid]
+        return self._key[is_bid][lo:hi], self._size[is_bid][lo:hi]
+
+    def snapshot(self) -> Snapshot:
+        (bid_key, bid_size), (ask_key, ask_size) = self._side(True), self._side(False)
+        return Snapshot(-bid_key, bid_size.copy(), ask_key.copy(), ask_size.copy())
+
+
+def iter_deltas(origin: dict, dest: dict):
+    """
+    Cursor over two exchanges stored as deltas (to_deltas): yields the as-of aligned (origin_timestamp,
+    origin_snapshot, dest_timestamps, dest_deltas) tuples. The origin book is kept up to date from its
+    deltas (DeltaBook) and served as a copy of its levels every tick, while every destination update
+    since the previous origin snapshot (dest_updates) is served as its level changes (the first one as
+    the net changes from an empty book), for XEMM.step to apply to its live book.
+    """
+    origin_book = DeltaBook()
+    applied, dest_at = 0, 0
+    origin_idx, dest_idx = asof_alignment(origin['timestamp'], dest['timestamp'])
+    for i, start, j in zip(origin_idx, dest_updates(dest_idx), dest_idx):
+        origin_book.apply(deltas_between(origin, applied, i + 1))
+        applied = i + 1
+        dest_deltas = []
+        for k in range(start, j + 1):
+            dest_deltas.append(deltas_between(dest, dest_at, k + 1))
+            dest_at = k + 1
+        yield (str(origin['key'][i]), origin_book.snapshot(), [str(dest['key'][k]) for k in range(start, j + 1)],
+               dest_deltas)
+
+
+def _file_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cache_dir(file_path: str) -> str:
+    return file_path + '.cache'
+
+
+def _cache_is_valid(file_path: str, cache_dir: str) -> bool:
+    """
+    The cache is valid if its source has the same size and modification time, or the same contents
+    (the modification time is then refreshed so the hash is not computed again).
+    """
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    stat = os.stat(file_path)
+    if meta.get('version') != _CACHE_VERSION or meta['size'] != stat.st_size:
+        return False
+    if meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    if meta['sha256'] != _file_hash(file_path):
+        return False
+
+    meta['mtime_ns'] = stat.st_mtime_ns
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+def cache_jsonOB(file_name:str, file_dir:str = None) -> str:
+    """
+    One-time conversion of the orderbooks file into a columnar binary cache, next to the file.
+    For each exchange, the levels of every snapshot are stored as flat level/bid/bid_size/ask/ask_size
+    arrays (.npy), with the snapshot keys, int64 nanosecond timestamps and the offsets where each
+    snapshot starts. The conversion is skipped if the cache is up to date with the file.
+
+    Parameters
+    ----------
+
+    file_name:str
+        String indicating the name of the file to be read. (must include '.json')
+
+    file_dir:str (default: None)
+        String indicating the directory where the file is saved.
+        If left unspecified, file's directory is assumed to be in current folder.
+
+
+    Returns
+    -------
+
+    cache_dir:str
+        Directory holding the cached arrays.
+
+    """
+
+    file_path = _file_path(file_name, file_dir)
+    cache_dir = _cache_dir(file_path)
+    if _cache_is_valid(file_path, cache_dir):
+        return cache_dir
+
+    stat = os.stat(file_path)
+    tmp_dir = f'{cache_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    exchanges = _exchanges(file_path)
+    for exchange in exchanges:
+        columns = to_columns(_iter_exchange(file_path, exchange))
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_dir, f'{exchange}_{col}.npy'), values)
+
+    # metadata is written last and marks the cache as complete
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': _CACHE_VERSION, 'source': os.path.abspath(file_path), 'exchanges': exchanges,
+                   'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'sha256': _file_hash(file_path)}, f)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # another process published the cache first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return cache_dir
+
+
+def read_cacheOB(file_name:str, file_dir:str = None) -> dict:
+    """
+    Memory-maps the columnar cache of the orderbooks file (built with cache_jsonOB if needed).
+
+    Parameters
+    ----------
+
+    file_name:str
+        String indicating the name of the file to be read. (must include '.json')
+
+    file_dir:str (default: None)
+        String indicating the directory where the file is saved.
+        If left unspecified, file's directory is assumed to be in current folder.
+
+
+    Returns
+    -------
+
+    cache:dict
+        Dictionary with the exchanges as keys and dictionaries of read-only memory-mapped arrays
+        ('key', 'timestamp', 'offsets', 'level', 'bid', 'bid_size', 'ask', 'ask_size') as values.
+
+    """
+
+    cache_dir = cache_jsonOB(file_name, file_dir)
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        exchanges = json.load(f)['exchanges']
+    return {exchange: {col: np.load(os.path.join(cache_dir, f'{exchange}_{col}.npy'), mmap_mode='r')
+                       for col in _COLUMNS}
+            for exchange in exchanges}
+
+
+def iter_cacheOB(file_name:str, file_dir:str = None):
+    """
+    Same aligned (origin_timestamp, origin_snapshot, dest_timestamps, dest_snapshots) tuples as
+    iter_jsonOB, with the lists of every destination update since the previous origin snapshot,
+    served as zero-copy views of the memory-mapped columnar cache (iter_columns).
+
+    Parameters
+    ----------
+
+    file_name:str
+        String indicating the name of the file to be read. (must include '.json')
+
+    file_dir:str (default: None)
+        String indicating the directory where the file is saved.
+        If left unspecified, file's directory is assumed to be in current folder.
+
+    """
+
+    cache = read_cacheOB(file_name, file_dir)
+    return iter_columns(cache['kraken'], cache['bitfinex'])
+
+
+def iter_deltaOB(file_name:str, file_dir:str = None):
+    """
+    Same aligned stream as iter_cacheOB with the destination (bitfinex) served as level deltas
+    (iter_deltas), which the XEMM splices into its live book instead of rebuilding it every update.
+    Each level visited still costs a few NumPy calls, so this only pays off on deep books where few
+    levels change per update; when most of them change (a 25-level update of the captured files has
+    ~70 deltas) it is slower than iter_cacheOB, which stays the default. The deltas are computed from
+    the cache on every call (to_deltas).
+
+    Parameters
+    ----------
+
+    file_name:str
+        String indicating the name of the file to be read. (must include '.json')
+
+    file_dir:str (default: None)
+        String indicating the directory where the file is saved.
+        If left unspecified, file's directory is assumed to be in current folder.
+
+    """
+
+    cache = read_cacheOB(file_name, file_dir)
+    return iter_deltas(to_deltas(cache['kraken']), to_deltas(cache['bitfinex']))
+
+
+class _Table:
+    """
+    Growable structured array; when a directory is given, full buffers are written to numbered .npy
+    chunk files (<name>_00000.npy, ...) so only one chunk is held in memory.
+    """
+    def __init__(self, dtype, name: str, path: str = None, chunk_size: int = 1 << 16):
+        self.dtype = np.dtype(dtype)
+        self.name = name
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buf = np.empty(256 if path is None else chunk_size, dtype=self.dtype)
+        self.n = 0
+        self.chunks = 0
+
+    def __len__(self) -> int:
+        return self.chunks*self.chunk_size + self.n
+
+    def _reserve(self, n: int):
+        if self.n + n <= len(self.buf):
+            return
+        buf = np.empty(max(2*len(self.buf), self.n + n), dtype=self.dtype)
+        buf[:self.n] = self.buf[:self.n]
+        self.buf = buf
+
+    def append(self, row: tuple):
+        self._reserve(1)
+        self.buf[self.n] = row
+        self.n += 1
+        if self.n == self.chunk_size and self.path is not None:
+            self.flush()
+
+    def extend(self, rows: dict):
+        rows = dict(zip(rows, np.broadcast_arrays(*rows.values())))
+        n = len(next(iter(rows.values())))
+        lo = 0
+        while lo < n:
+            # rows up to the end of the current chunk when streaming to disk
+            hi = n if self.path is None else min(n, lo + self.chunk_size - self.n)
+            self._reserve(hi - lo)
+            for field, values in rows.items():
+                self.buf[field][self.n:self.n+hi-lo] = values[lo:hi]
+            self.n += hi - lo
+            if self.n == self.chunk_size and self.path is not None:
+                self.flush()
+            lo = hi
+
+    def __getstate__(self):
+        # only the buffered rows are serialized (stores sent to other processes); chunk files stay on disk
+        return {**self.__dict__, 'buf': self.buf[:self.n].copy()}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        buf = np.empty(max(self.n, 256 if self.path is None else self.chunk_size), dtype=self.dtype)
+        buf[:self.n] = self.buf
+        self.buf = buf
+
+    def flush(self):
+        # writes the buffered rows as the current chunk file, moving to the next one once it is full
+        if self.path is None or self.n == 0:
+            return
+        np.save(self._chunk(self.chunks), self.buf[:self.n])
+        if self.n == self.chunk_size:
+            self.chunks += 1
+            self.n = 0
+
+    def _chunk(self, i: int) -> str:
+        return os.path.join(self.path, f'{self.name}_{i:05d}.npy')
+
+    def truncate(self, n: int):
+        # keeps the first n rows: the chunk holding row n is read back into the buffer and the chunk
+        # files after it are removed
+        if self.path is None:
+            self.n = min(self.n, n)
+            return
+        chunks, self.n = divmod(n, self.chunk_size)
+        if self.n:
+            self.buf[:self.n] = np.load(self._chunk(chunks))[:self.n]
+        i = chunks + (self.n > 0)
+        while os.path.exists(self._chunk(i)):
+            os.remove(self._chunk(i))
+            i += 1
+        self.chunks = chunks
+
+    def read(self) -> np.ndarray:
+        if self.path is None:
+            return self.buf[:self.n]
+        parts = [np.load(self._chunk(i), mmap_mode='r') for i in range(self.chunks)]
+        return np.concatenate(parts + [self.buf[:self.n]])
+
+
+# columns of the metrics table, in the order of functions.RunningMetrics.mark
+METRICS = ('mid', 'pnl', 'drawdown', 'max_drawdown', 'inventory', 'dest_inventory', 'dest_vwap', 'fill_ratio',
+           'fees', 'fee_drag')
+
+
+class ResultsStore:
+    """
+    Columnar store of the results of an XEMM run, written to preallocated structured arrays instead
+    of growing lists and one DataFrame per snapshot.
+
+    Tables:
+    -------
+        snapshots: one row per destination update, with its nanosecond timestamp, the balances after
+          it and the top levels of the XEMM orderbook when it arrived (bid, bid_size, bid_added_vol,
+          ask, ask_size, ask_added_vol as arrays of `depth` levels, nan padded).
+        fees: every fee paid, with its timestamp and whether it was paid on the origin.
+        fills: every fill of the XEMM, with its timestamp, price, size, side and whether it was a
+          hedge on the origin.
+        metrics: one row per tick (origin snapshot), with its nanosecond timestamp and the running
+          P&L, inventory and risk metrics after it (see functions.RunningMetrics).
+        quoted: one row per origin update, with its nanosecond timestamp and the volume quoted on the
+          destination for it.
+        books: the keys of the sampled orderbooks when streaming to disk, each one saved as its own
+          .npy file (book_000000.npy, ...) in the order of the table.
+
+    Parameters:
+    -----------
+        depth: levels per side kept in the snapshots table (int) (default = 10)
+        sample_every: a full orderbook DataFrame is kept every this many snapshots, 0 for none (int)
+          (default = 1, every snapshot)
+        path: directory where the tables are streamed in chunks of .npy files (str) (default = None,
+          in memory)
+        chunk_size: rows per chunk file (int) (default = 65,536)
+
+    Methods:
+    --------
+        --add_snapshot, add_fee, add_fees, add_fill, add_fills, add_metrics, add_quoted: append rows
+          to the tables.
+        --sample: whether the full orderbook of the next snapshot is kept (add_book).
+        --books: the kept orderbooks by destination timestamp (read back from disk) (property).
+        --table: a table as a structured array (chunks read back from disk).
+        --flush: writes the buffered rows to disk.
+        --offsets, truncate: rows of every table, and dropping the rows written after them (checkpoints).
+    """
+    def __init__(self, depth: int = 10, sample_every: int = 1, path: str = None, chunk_size: int = 1 << 16):
+        self.depth = depth
+        self.sample_every = sample_every
+        self.path = path
+        self.chunk_size = chunk_size
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        levels = [(col, 'f8', (depth,)) for col in ('bid', 'bid_size', 'bid_added_vol',
+                                                     'ask', 'ask_size', 'ask_added_vol')]
+        self._tables = {
+            'snapshots': _Table([('timestamp', 'i8'), ('fiat_bal_dest', 'f8'), ('token_bal_dest', 'f8'),
+                                 ('fiat_bal_origin', 'f8'), ('token_bal_origin', 'f8')] + levels,
+                                'snapshots', path, chunk_size),
+            'fees': _Table([('timestamp', 'i8'), ('origin', '?'), ('fee', 'f8')], 'fees', path, chunk_size),
+            'fills': _Table([('timestamp', 'i8'), ('hedge', '?'), ('price', 'f8'), ('size', 'f8'),
+                             ('is_bid', '?')], 'fills', path, chunk_size),
+            'metrics': _Table([('timestamp', 'i8')] + [(col, 'f8') for col in METRICS], 'metrics', path,
+                              chunk_size),
+            'quoted': _Table([('timestamp', 'i8'), ('volume', 'f8')], 'quoted', path, chunk_size),
+            'books': _Table([('key', 'U32')], 'books', path, chunk_size)}
+        self._books = {}
+
+    def __len__(self) -> int:
+        return len(self._tables['snapshots'])
+
+    def sample(self) -> bool:
+        return self.sample_every > 0 and len(self) % self.sample_every == 0
+
+    def add_book(self, key: str, book: pd.DataFrame):
+        if self.path is None:
+            self._books[key] = book
+            return
+        np.save(self._book(len(self._tables['books'])), book.to_records(index=False))
+        self._tables['books'].append((key,))
+
+    def _book(self, i: int) -> str:
+        return os.path.join(self.path, f'book_{i:06d}.npy')
+
+    @property
+    def books(self) -> dict:
+        if self.path is None:
+            return self._books
+        return {str(key): pd.DataFrame(np.load(self._book(i)))
+                for i, key in enumerate(self._tables['books'].read()['key'])}
+
+    def add_snapshot(self, timestamp: int, balances: tuple, levels: tuple):
+        self._tables['snapshots'].append((timestamp, *balances, *levels))
+
+    def add_fee(self, timestamp: int, origin: bool, fee: float):
+        self._tables['fees'].append((timestamp, origin, fee))
+
+    def add_fees(self, timestamp: int, origin: bool, fees: np.ndarray):
+        self._tables['fees'].extend({'timestamp': timestamp, 'origin': origin, 'fee': fees})
+
+    def add_fill(self, timestamp: int, hedge: bool, price: float, size: float, is_bid: bool):
+        self._tables['fills'].append((timestamp, hedge, price, size, is_bid))
+
+    def add_fills(self, timestamp: int, hedge: bool, price: np.ndarray, size: np.ndarray, is_bid):
+        self._tables['fills'].extend({'timestamp': timestamp, 'hedge': hedge, 'price': price,
+                                      'size': size, 'is_bid': is_bid})
+
+    def add_metrics(self, timestamp: int, metrics: tuple):
+        self._tables['metrics'].append((timestamp, *metrics))
+
+    def add_quoted(self, timestamp: int, volume: float):
+        self._tables['quoted'].append((timestamp, volume))
+
+    def table(self, name: str) -> np.ndarray:
+        return self._tables[name].read()
+
+    def flush(self):
+        for table in self._tables.values():
+            table.flush()
+
+    def offsets(self) -> dict:
+        return {name: len(table) for name, table in self._tables.items()}
+
+    def truncate(self, offsets: dict):
+        # book files past the saved count are left to be overwritten, the index table is the source of truth
+        for name, n in offsets.items():
+            self._tables[name].truncate(n)
+
+
+def synthetic_jsonOB(n_snapshots: int = 100, depth: int = 100, dest_depth: int = 25,
+                     volatility: float = 5.0, seed: int = 0) -> dict:
+    """
+    Seeded synthetic orderbooks in the layout of the captured JSON files, for benchmarks.
+    Both exchanges follow random-walk mids around 28,300 (the destination one with half the
+    volatility); the origin ('kraken') updates every ~3 seconds with 0.1 ticks and the destination
+    ('bitfinex') every ~1.5 seconds with integer prices.
+
+    Parameters
+    ----------
+
+    n_snapshots:int (default: 100)
+        Number of origin snapshots; the destination covers the same time span.
+
+    depth:int (default: 100)
+        Levels per side of the origin snapshots.
+
+    dest_depth:int (default: 25)
+        Levels per side of the destination snapshots.
+
+    volatility:float (default: 5.0)
+        Standard deviation of the origin mid-price change between snapshots.
+
+    seed:int (default: 0)
+        Seed of the random generator.
+
+
+    Returns
+    -------
+
+    orderbooks:dict
+        {'kraken': {timestamp: snapshot}, 'bitfinex': {timestamp: snapshot}}, every snapshot being a
+        JSON object of 'bid_size', 'bid', 'ask', 'ask_size' keyed by level.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2021-07-05T13:06:49.495', 'ms')
+
+    def key(ms):
+        return str(start + np.timedelta64(int(ms), 'ms')) + 'Z'
+
+    def snapshot(bid, bid_size, ask, ask_size):
+        levels = [str(i) for i in range(len(bid))]
+        return {name: dict(zip(levels, values.tolist()))
+                for name, values in zip(Snapshot._fields, (bid, bid_size, ask, ask_size))}
+
+    origin = {}
+    mid = 28300 + np.cumsum(rng.normal(0, volatility, n_snapshots))
+    for i in range(n_snapshots):
+        bid = np.round(mid[i] - .05 - np.cumsum(rng.integers(1, 30, depth))*.1, 1)
+        ask = np.round(mid[i] + .05 + np.cumsum(rng.integers(1, 30, depth))*.1, 1)
+        sizes = np.round(rng.exponential(.5, (2, depth)), 3)
+        origin[key(3000*i + rng.integers(0, 100))] = snapshot(bid, sizes[0], ask, sizes[1])
+
+    dest = {}
+    dest_mid, ms = 28300.0, -2900
+    while ms < 3000*(n_snapshots + 1):
+        dest_mid += rng.normal(0, volatility / 2)
+        bid = np.floor(dest_mid) - np.cumsum(rng.integers(1, 3, dest_depth)) + 1
+        ask = np.floor(dest_mid) + np.cumsum(rng.integers(1, 3, dest_depth))
+        sizes = np.round(rng.exponential(1., (2, dest_depth)), 6)
+        dest[key(ms)] = snapshot(bid, sizes[0], ask, sizes[1])
+        ms += rng.integers(1300, 1700)
+
+    return {'kraken': origin, 'bitfinex': dest}
+
+
 def describe(file_name:str, data:dict):
     """
     Brief description of input data.
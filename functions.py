@@ -10,12 +10,733 @@
 
 import pandas as pd
 import numpy as np
+import data as dt
+import os
+import heapq
+import itertools
+import pickle
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# the sequential arrival kernel is compiled when numba is installed; every batch of order arrivals
+# then goes through it, otherwise it only runs (interpreted) the batches that must stay sequential
+HAS_NUMBA = njit is not None
+USE_KERNEL = HAS_NUMBA
+
+
+class BookSide:
+    """
+    One side (bids or asks) of an orderbook stored in contiguous NumPy arrays.
+
+    Levels are kept sorted from the top of the book inside preallocated price/size/added-volume
+    buffers with free slots at both ends, so consuming the top of the book only moves a pointer and
+    inserting a level locates its slot with a binary search and shifts the shorter half of the book.
+
+    Parameters:
+    -----------
+        price: level prices ordered from the top of the book (array-like)
+        size: level volumes (array-like)
+        side: 'bid' or 'ask' (str)
+        added: volume added by the XEMM on each level (array-like) (default = zeros)
+        tick: tick size of the exchange; prices are then kept as integer ticks, so levels match
+          exactly (float) (default = None, float prices)
+
+    The deepest key consumed or dropped from the top since the side was built is kept in touched, and
+    the keys whose volume may not be exactly the exchange's (XEMM volume added or left on them) in
+    unstable, for reconcile_deltas.
+
+    Methods:
+    --------
+        --top: best price of the side (nan if empty).
+        --to_key: converts prices into the sorting keys of the side.
+        --better_than: number of levels strictly better than a given price.
+        --insert: adds a maker order to the side.
+        --insert_many: adds a batch of maker orders to the side.
+        --consume: walks the book taking a batch of volumes from the top.
+        --drop: removes levels from the top of the side.
+        --splice: sets, inserts and removes levels in place (data.splice_levels).
+        --reserve: makes room for n insertions at either end of the buffers.
+    """
+    __slots__ = ('sign', 'tick', '_scale', '_key', '_size', '_added', '_lo', '_hi', 'touched', 'unstable')
+
+    def __init__(self, price, size, side: str='bid', added=None, tick: float=None):
+        price = np.asarray(price, dtype=float)
+        size = np.asarray(size, dtype=float)
+        keep = ~np.isnan(price)
+        n = int(keep.sum())
+
+        # prices are stored as a key that increases away from the top of the book: the signed price,
+        # or the signed number of ticks (ticks per unit of price are rounded when integer, e.g. 10 for
+        # a 0.1 tick, so key / scale gives back the exchange's prices)
+        self.sign = -1.0 if side == 'bid' else 1.0
+        self.tick = tick
+        self._scale = None if tick is None else _ticks_per_unit(tick)
+        capacity = 2*n + 8
+        self._lo = (capacity - n) // 2
+        self._hi = self._lo + n
+        self._key = np.empty(capacity, dtype=float if tick is None else np.int64)
+        self._size = np.empty(capacity)
+        self._added = np.zeros(capacity)
+        self._key[self._lo:self._hi] = self.to_key(price[keep])
+        self._size[self._lo:self._hi] = size[keep]
+        if added is not None:
+            self._added[self._lo:self._hi] = np.asarray(added, dtype=float)[keep]
+        self.touched = -np.inf
+        self.unstable = self.key[self.added != 0]
+
+    def __len__(self) -> int:
+        return self._hi - self._lo
+
+    @property
+    def price(self) -> np.ndarray:
+        return self._to_price(self._key[self._lo:self._hi])
+
+    @property
+    def size(self) -> np.ndarray:
+        return self._size[self._lo:self._hi]
+
+    @property
+    def added(self) -> np.ndarray:
+        return self._added[self._lo:self._hi]
+
+    @property
+    def key(self) -> np.ndarray:
+        return self._key[self._lo:self._hi]
+
+    def to_key(self, price):
+        if self._scale is None:
+            return self.sign*price
+        return np.rint(self.sign*self._scale*np.asarray(price)).astype(np.int64)
+
+    def _to_price(self, key):
+        return self.sign*key if self._scale is None else self.sign*key / self._scale
+
+    def top(self) -> float:
+        return self._to_price(self._key[self._lo]) if self._hi > self._lo else np.nan
+
+    def better_than(self, price: float) -> int:
+        if np.isnan(price):
+            return 0
+        key = self.sign*price
+        if self._scale is not None:
+            # prices on the tick grid compare equal to their level
+            key *= self._scale
+            if abs(key - round(key)) < 1e-6:
+                key = round(key)
+        return int(np.searchsorted(self._key[self._lo:self._hi], key, side='left'))
+
+    def drop(self, n: int):
+        if n:
+            self.touched = max(self.touched, float(self._key[self._lo + n - 1]))
+        self._lo += n
+
+    def insert(self, price: float, size: float):
+        """
+        Adds a maker order of the given size at the given price, creating the level if needed.
+        A quote identical to the volume already resting on a level added by the XEMM is not stacked.
+        """
+        key = self.to_key(price)
+        self.unstable = np.append(self.unstable, key)
+        i = self._lo + int(np.searchsorted(self._key[self._lo:self._hi], key, side='left'))
+
+        if i < self._hi and self._key[i] == key:
+            if self._size[i] == size and self._added[i] == size:
+                return
+            self._size[i] += size
+            self._added[i] += size
+            return
+
+        if self._lo == 0 or self._hi == len(self._key):
+            i -= self._lo
+            self._grow()
+            i += self._lo
+
+        # open a slot by shifting the shorter half of the book
+        lo, hi = self._lo, self._hi
+        if i - lo < hi - i:
+            for arr in (self._key, self._size, self._added):
+                arr[lo-1:i-1] = arr[lo:i]
+            self._lo -= 1
+            i -= 1
+        else:
+            for arr in (self._key, self._size, self._added):
+                arr[i+1:hi+1] = arr[i:hi]
+            self._hi += 1
+
+        self._key[i] = key
+        self._size[i] = size
+        self._added[i] = size
+
+    def insert_many(self, price, size):
+        """
+        Adds maker orders as consecutive calls to insert would, merging all the new levels into the
+        side at once.
+        """
+        price = np.asarray(price, dtype=float)
+        size = np.asarray(size, dtype=float)
+        key = self.to_key(price)
+        if len(np.unique(key)) < len(key):
+            # orders on the same level depend on each other
+            for p, s in zip(price, size):
+                self.insert(p, s)
+            return
+        self.unstable = np.append(self.unstable, key)
+
+        book_key = self.key
+        pos = np.searchsorted(book_key, key, side='left')
+        exists = pos < len(book_key)
+        exists[exists] = book_key[pos[exists]] == key[exists]
+
+        # orders joining a level, unless the identical quote already rests there as XEMM volume
+        at, joined = self._lo + pos[exists], size[exists]
+        stack = ~((self._size[at] == joined) & (self._added[at] == joined))
+        self._size[at[stack]] += joined[stack]
+        self._added[at[stack]] += joined[stack]
+
+        new = ~exists
+        if new.any():
+            order = np.argsort(key[new])
+            self.splice(key[new][order], size[new][order], size[new][order])
+
+    def consume(self, volumes) -> tuple:
+        """
+        Takes the given volumes, one after the other, from the top of the book: fully consumed levels
+        are dropped and the remaining volume is left on the surviving level.
+        Returns the average execution price and the best price before each volume (see sweep).
+        """
+        vwap, top, consumed, residual = sweep(self.price, self.size, volumes)
+        if consumed < len(self):
+            self._size[self._lo + consumed] = residual
+            self.touched = max(self.touched, float(self._key[self._lo + consumed]))
+        else:
+            self.touched = np.inf
+        self._lo += consumed
+        return vwap, top
+
+    def splice(self, key: np.ndarray, size: np.ndarray, added: np.ndarray = None):
+        """
+        Sets the levels of the given ascending keys in place: existing levels take the new size (and
+        added volume), missing ones are inserted and the ones with a nan size removed, moving only the
+        span between the changes and the shorter end of the side (data.splice_levels).
+        """
+        self.reserve(len(key))
+        added = np.zeros(len(key)) if added is None else added
+        self._lo, self._hi = dt.splice_levels([self._key, self._size, self._added], self._lo, self._hi,
+                                              key, [size, added])
+
+    def _set(self, key: np.ndarray, size: np.ndarray, added: np.ndarray):
+        n = len(key)
+        capacity = 2*n + 8
+        lo = (capacity - n) // 2
+        for name, values in (('_key', key), ('_size', size), ('_added', added)):
+            arr = np.zeros(capacity, dtype=getattr(self, name).dtype)
+            arr[lo:lo+n] = values
+            setattr(self, name, arr)
+        self._lo, self._hi = lo, lo + n
+
+    def __getstate__(self):
+        # only the live levels are serialized (checkpoints)
+        return {'sign': self.sign, 'tick': self.tick, '_scale': self._scale, 'key': self.key.copy(),
+                'size': self.size.copy(), 'added': self.added.copy(), 'touched': self.touched,
+                'unstable': self.unstable}
+
+    def __setstate__(self, state: dict):
+        self.sign, self.tick, self._scale = state['sign'], state['tick'], state['_scale']
+        self._key, self._size, self._added = state['key'][:0], state['size'][:0], state['added'][:0]
+        self._set(state['key'], state['size'], state['added'])
+        self.touched, self.unstable = state['touched'], state['unstable']
+
+    def reserve(self, n: int):
+        if self._lo < n or len(self._key) - self._hi < n:
+            self._grow(n)
+
+    def _grow(self, room: int = 0):
+        n = len(self)
+        capacity = 2*n + 2*room + 8
+        lo = (capacity - n) // 2
+        for name in ('_key', '_size', '_added'):
+            arr = np.zeros(capacity, dtype=getattr(self, name).dtype)
+            arr[lo:lo+n] = getattr(self, name)[self._lo:self._hi]
+            setattr(self, name, arr)
+        self._lo, self._hi = lo, lo + n
+
+
+def _ticks_per_unit(tick: float) -> float:
+    scale = 1 / tick
+    return float(round(scale)) if abs(scale - round(scale)) < 1e-9 else scale
+
+
+def _to_grid(values: np.ndarray, step: float, rounding) -> np.ndarray:
+    """
+    Rounds values onto a grid of the given step (tick or lot size) with np.floor or np.ceil, values
+    already on the grid up to float noise being kept.
+    """
+    scale = _ticks_per_unit(step)
+    units = values*scale
+    return rounding(np.where(np.abs(units - np.rint(units)) < 1e-6, np.rint(units), units)) / scale
+
+
+def _arrivals_kernel(order_key, order_price, order_size, order_bid, bid_key, bid_size, bid_added, bid_bounds,
+                     ask_key, ask_size, ask_added, ask_bounds, touched, scale):
+    """
+    Sequential kernel of a batch of order arrivals on the destination orderbook, over the raw
+    buffers of its sides (see BookSide): each order crossing the opposite top takes its volume from
+    it (levels are consumed with the same accumulated depth as sweep), otherwise it is inserted as a
+    maker (same rule as BookSide.insert). The bounds ([lo, hi] of each side) and the deepest keys
+    taken ([bid, ask], see BookSide.touched) are updated in place, and the sides must have room for
+    every insertion (BookSide.reserve).
+
+    Plain loops over NumPy arrays, compiled with numba when it is installed.
+
+    Returns:
+    --------
+        Top price each taker order filled at, nan for the makers (np.ndarray).
+    """
+    top = np.full(len(order_key), np.nan)
+    for i in range(len(order_key)):
+        if order_bid[i]:
+            key, size, added, bounds = bid_key, bid_size, bid_added, bid_bounds
+            opp_key, opp_size, opp_bounds, opp_sign = ask_key, ask_size, ask_bounds, 1.0
+        else:
+            key, size, added, bounds = ask_key, ask_size, ask_added, ask_bounds
+            opp_key, opp_size, opp_bounds, opp_sign = bid_key, bid_size, bid_bounds, -1.0
+        vol = order_size[i]
+
+        # taker: bids at or above the best ask, asks below the best bid
+        lo, hi = opp_bounds[0], opp_bounds[1]
+        if lo < hi:
+            best = opp_sign*opp_key[lo] / scale
+            if (order_price[i] >= best) if order_bid[i] else (order_price[i] < best):
+                top[i] = best
+                accum = 0.0
+                level = lo
+                while level < hi:
+                    accum += opp_size[level]
+                    if accum >= vol:
+                        break
+                    level += 1
+                if level < hi:
+                    opp_size[level] = accum - vol
+                    deepest = float(opp_key[level])
+                else:
+                    deepest = np.inf
+                side = 1 if order_bid[i] else 0
+                if deepest > touched[side]:
+                    touched[side] = deepest
+                opp_bounds[0] = level
+                continue
+
+        # maker: join the level or open a slot shifting the shorter half of the side
+        lo, hi = bounds[0], bounds[1]
+        k = order_key[i]
+        at = lo + np.searchsorted(key[lo:hi], k)
+        if at < hi and key[at] == k:
+            if not (size[at] == vol and added[at] == vol):
+                size[at] += vol
+                added[at] += vol
+            continue
+        if at - lo < hi - at:
+            key[lo-1:at-1] = key[lo:at].copy()
+            size[lo-1:at-1] = size[lo:at].copy()
+            added[lo-1:at-1] = added[lo:at].copy()
+            bounds[0] = lo - 1
+            at -= 1
+        else:
+            key[at+1:hi+1] = key[at:hi].copy()
+            size[at+1:hi+1] = size[at:hi].copy()
+            added[at+1:hi+1] = added[at:hi].copy()
+            bounds[1] = hi + 1
+        key[at] = k
+        size[at] = vol
+        added[at] = vol
+    return top
+
+
+if HAS_NUMBA:
+    _arrivals_kernel = njit(cache=True)(_arrivals_kernel)
+
+
+def sweep(price: np.ndarray, size: np.ndarray, volumes) -> tuple:
+    """
+    Walks one side of an orderbook by a batch of volumes executed one after the other, in a single
+    pass over the accumulated depth.
+
+    Parameters:
+    -----------
+        price: level prices ordered from the top of the book (np.ndarray)
+        size: level volumes (np.ndarray)
+        volumes: volumes to fill in execution order (array-like)
+
+    Returns:
+    --------
+        vwap: average execution price of each volume, over the visible depth only (np.ndarray)
+        top: best price when each volume starts executing, the deepest price once the depth is
+            exhausted (np.ndarray)
+        consumed: number of levels fully consumed by the batch (int)
+        residual: volume left on the surviving level, nan if the whole depth was consumed (float)
+    """
+    volumes = np.atleast_1d(np.asarray(volumes, dtype=float))
+    if len(price) == 0:
+        return np.full(len(volumes), np.nan), np.full(len(volumes), np.nan), 0, np.nan
+
+    accum_size = np.cumsum(size)
+    accum_notional = np.cumsum(price*size)
+    if len(volumes) == 1:
+        # single volume (sequential taker fills): same arithmetic without the batch bookkeeping
+        volume = volumes[0]
+        level = int(np.searchsorted(accum_size, volume, side='left'))
+        if level < len(price):
+            size_before = accum_size[level - 1] if level > 0 else 0.0
+            notional_before = accum_notional[level - 1] if level > 0 else 0.0
+            filled, notional = volume, notional_before + (volume - size_before)*price[level]
+            residual = accum_size[level] - volume
+        else:
+            filled, notional, residual = accum_size[-1], accum_notional[-1], np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = np.float64(notional) / filled
+        return np.array([vwap]), price[:1].copy(), level, residual
+
+    bounds = np.concatenate(([0.0], np.cumsum(volumes)))
+
+    # first level whose accumulated volume covers each bound
+    level = np.searchsorted(accum_size, bounds, side='left')
+    inside = level < len(price)
+    at = np.minimum(level, len(price) - 1)
+
+    size_before = np.where(at > 0, accum_size[at - 1], 0.0)
+    notional_before = np.where(at > 0, accum_notional[at - 1], 0.0)
+    filled = np.where(inside, bounds, accum_size[-1])
+    notional = np.where(inside, notional_before + (bounds - size_before)*price[at], accum_notional[-1])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = np.diff(notional) / np.diff(filled)
+
+    consumed = int(level[-1])
+    residual = accum_size[consumed] - bounds[-1] if inside[-1] else np.nan
+    return vwap, price[at[:-1]], consumed, residual
+
+
+class OrderBook:
+    """
+    Pair of array-backed bid and ask sides.
+
+    Parameters:
+    -----------
+        bid: bid side of the orderbook (BookSide)
+        ask: ask side of the orderbook (BookSide)
+
+    Methods:
+    --------
+        --from_snapshot: builds the orderbook from a data.Snapshot (optionally on a tick grid).
+        --arrivals: sequential taker fills and maker insertions of a batch of orders.
+        --levels: top levels of each side as nan padded arrays.
+        --to_frame: returns the orderbook as a DataFrame including the volume added by the XEMM.
+    """
+    __slots__ = ('bid', 'ask')
+
+    def __init__(self, bid: BookSide, ask: BookSide):
+        self.bid = bid
+        self.ask = ask
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dt.Snapshot, tick: float=None):
+        return cls(BookSide(snapshot.bid, snapshot.bid_size, 'bid', tick=tick),
+                   BookSide(snapshot.ask, snapshot.ask_size, 'ask', tick=tick))
+
+    def arrivals(self, price: np.ndarray, size: np.ndarray, is_bid: np.ndarray) -> np.ndarray:
+        """
+        Orders reaching the book one after the other (see _arrivals_kernel): takers consume the
+        opposite side and makers are inserted. Returns the top price each taker filled at, nan for the
+        makers.
+        """
+        bid, ask = self.bid, self.ask
+        key = np.where(is_bid, bid.to_key(price), ask.to_key(price))
+        bid.reserve(len(price))
+        ask.reserve(len(price))
+        bid_bounds = np.array([bid._lo, bid._hi], dtype=np.int64)
+        ask_bounds = np.array([ask._lo, ask._hi], dtype=np.int64)
+        touched = np.array([bid.touched, ask.touched])
+        top = _arrivals_kernel(key, price, size, is_bid, bid._key, bid._size, bid._added, bid_bounds,
+                               ask._key, ask._size, ask._added, ask_bounds, touched, bid._scale or 1.0)
+        bid._lo, bid._hi = int(bid_bounds[0]), int(bid_bounds[1])
+        ask._lo, ask._hi = int(ask_bounds[0]), int(ask_bounds[1])
+        bid.touched, ask.touched = float(touched[0]), float(touched[1])
+        maker = np.isnan(top)
+        bid.unstable = np.append(bid.unstable, key[maker & is_bid])
+        ask.unstable = np.append(ask.unstable, key[maker & ~is_bid])
+        return top
+
+    def levels(self, n: int) -> tuple:
+        """
+        Best n levels as (bid, bid_size, bid_added_vol, ask, ask_size, ask_added_vol) arrays, padded
+        with nan where a side has fewer levels.
+        """
+        def pad(values):
+            out = np.full(n, np.nan)
+            out[:min(n, len(values))] = values[:n]
+            return out
+
+        return (pad(self.bid.price), pad(self.bid.size), pad(self.bid.added),
+                pad(self.ask.price), pad(self.ask.size), pad(self.ask.added))
+
+    def to_frame(self) -> pd.DataFrame:
+        bid, bid_size, bid_added, ask, ask_size, ask_added = self.levels(max(len(self.bid), len(self.ask)))
+        return pd.DataFrame({'bid_added_vol': bid_added, 'bid_size': bid_size, 'bid': bid,
+                             'ask': ask, 'ask_size': ask_size, 'ask_added_vol': ask_added})
+
+
+def _lookup(keys: np.ndarray, values: np.ndarray, at: np.ndarray, default) -> np.ndarray:
+    # values of the ascending keys at the given ones, default where a key is missing
+    if not len(keys):
+        return np.where(np.zeros(len(at), dtype=bool), 0., default)
+    pos = np.minimum(np.searchsorted(keys, at), len(keys) - 1)
+    return np.where(keys[pos] == at, values[pos], default)
+
+
+def reconcile(side: BookSide, next_price: np.ndarray, next_size: np.ndarray):
+    """
+    Generates the next destination orderbook side from the current one (with the XEMM levels) and
+    the exchange's following snapshot.
+
+    Parameters:
+    -----------
+        side: current destination side including the added volume (BookSide)
+        next_price: prices on the following snapshot (np.ndarray)
+        next_size: volumes on the following snapshot (np.ndarray)
+
+    Returns:
+    --------
+        New destination side (BookSide).
+    """
+    cur_key = side.key
+    keep = ~np.isnan(next_price)
+    next_key = side.to_key(next_price[keep])
+
+    # volumes of both books over the merged (sorted) price grid
+    key = np.union1d(cur_key, next_key)
+    current_vol, added_vol, next_vol = np.zeros((3, len(key)))
+    cur_idx = np.searchsorted(key, cur_key)
+    current_vol[cur_idx] = side.size
+    added_vol[cur_idx] = side.added
+    next_vol[np.searchsorted(key, next_key)] = next_size[keep]
+
+    original_vol = current_vol - added_vol
+    in_next = next_vol != 0
+    new_vol = np.where(original_vol == 0,
+                       # scenario b: added level with volume in next ob, c: added level w/o volume in next ob
+                       np.where(in_next, current_vol + next_vol, added_vol),
+                       # scenario d: existing level with volume in next ob, a: existing level w/o volume in next ob
+                       np.where(in_next, current_vol + (next_vol - original_vol), 0.))
+
+    level = new_vol != 0
+    side_name = 'bid' if side.sign < 0 else 'ask'
+    return BookSide(side._to_price(key[level]), new_vol[level], side_name, added_vol[level], side.tick)
+
+
+def reconcile_deltas(side: BookSide, next_key: np.ndarray, next_size: np.ndarray,
+                     delta_key: np.ndarray) -> BookSide:
+    """
+    Same side as reconcile, computed in place from the level changes of the exchange instead of its
+    whole next snapshot. Only the levels changed by the exchange, the ones holding volume added by
+    the XEMM or otherwise different from the exchange's (BookSide.unstable) and the ones consumed or
+    dropped from the top since the last update (BookSide.touched) go through the reconcile
+    scenarios; every other level equals the exchange's, reconcile would give back its volume, and is
+    not visited. The recomputed levels are spliced in place (BookSide.splice), so no side is rebuilt:
+    the work is that of the visited levels plus moving the levels between the first and last ones
+    inserted or removed (and the shorter end of the side), instead of copying every level.
+
+    Parameters:
+    -----------
+        side: current destination side including the added volume (BookSide)
+        next_key: keys of the exchange's levels after the update, ascending (np.ndarray)
+        next_size: volumes of the exchange's levels after the update (np.ndarray)
+        delta_key: keys of the levels changed by the update (np.ndarray)
+
+    Returns:
+    --------
+        The updated side (BookSide).
+    """
+    cur_key = side.key
+    dirty = [delta_key, side.unstable]
+    if side.touched > -np.inf:
+        # levels consumed or dropped from the top, on the side and on the exchange (the exchange's
+        # previous levels there are either still in next_key or removed by a delta)
+        dirty.append(cur_key[:np.searchsorted(cur_key, side.touched, side='right')])
+        dirty.append(next_key[:np.searchsorted(next_key, side.touched, side='right')])
+    key = np.unique(np.concatenate(dirty))
+
+    # volumes of both books over the dirty levels
+    current_vol, added_vol = np.zeros((2, len(key)))
+    if len(cur_key):
+        pos = cur_key.searchsorted(key)
+        in_cur = cur_key.take(pos, mode='clip') == key
+        current_vol[in_cur] = side.size[pos[in_cur]]
+        added_vol[in_cur] = side.added[pos[in_cur]]
+    next_vol = _lookup(next_key, next_size, key, 0.)
+
+    original_vol = current_vol - added_vol
+    in_next = next_vol != 0
+    new_vol = np.where(original_vol == 0,
+                       np.where(in_next, current_vol + next_vol, added_vol),
+                       np.where(in_next, current_vol + (next_vol - original_vol), 0.))
+    level = new_vol != 0
+
+    # recomputed levels written back, removed and new ones spliced in order
+    side.splice(key, np.where(level, new_vol, np.nan), added_vol)
+    side.touched = -np.inf
+    side.unstable = key[level & (new_vol != next_vol)]
+    return side
+
+
+# simulation event kinds
+ORIGIN_UPDATE = 'origin_update'
+DEST_UPDATE = 'dest_update'
+ORDER_ARRIVAL = 'order_arrival'
+HEDGE = 'hedge'
+
+# profiler phase of each event handler
+_PHASES = {ORIGIN_UPDATE: 'replication', DEST_UPDATE: 'maker_fills', ORDER_ARRIVAL: 'order_arrival',
+           HEDGE: 'hedge'}
+
+
+class EventQueue:
+    """
+    Discrete-event queue of the XEMM simulation: a binary heap of (time, kind, payload) events that
+    pops them in time order, events sharing a timestamp in the order they were pushed.
+
+    Methods:
+    --------
+        --push: schedules an event at a nanosecond timestamp.
+        --peek_time: timestamp of the next event (None if the queue is empty).
+        --peek: kind of the next event (None if the queue is empty).
+        --pop: removes and returns the next (time, kind, payload) event.
+    """
+    __slots__ = ('_heap', '_seq')
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, time: int, kind: str, payload=None):
+        self._seq += 1
+        heapq.heappush(self._heap, (time, self._seq, kind, payload))
+
+    def peek_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def peek(self) -> str:
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self) -> tuple:
+        time, _, kind, payload = heapq.heappop(self._heap)
+        return time, kind, payload
+
+
+@lru_cache(maxsize=None)
+def _transaction_queue(n_levels: int, latency_limit: float) -> tuple:
+    """
+    Order in which the replicated levels reach the destination exchange and the elapsed time (ms) at
+    which each of them arrives, cut at the latency limit.
+    """
+    return _queue(np.random.RandomState(123).uniform(250, size=n_levels), latency_limit)
+
+
+def _queue(transaction_time: np.ndarray, latency_limit: float) -> tuple:
+    # levels sorted by transaction time, with their accumulated arrival time, cut at the limit
+    queue = np.argsort(transaction_time)
+    elapsed_time = np.cumsum(transaction_time[queue])
+    n_arrived = int(np.searchsorted(elapsed_time, latency_limit, side='right'))
+    return queue[:n_arrived], elapsed_time[:n_arrived]
+
+
+class RunningMetrics:
+    """
+    Running P&L, inventory and risk metrics of an XEMM run, updated in constant time with every
+    batch of fills and marked once per tick, so they never need a pass over the stored results.
+
+    Parameters:
+    -----------
+        fiat: initial cash over both exchanges (float)
+        token: initial tokens over both exchanges (float)
+
+    Methods:
+    --------
+        --sent: registers the volume of the quotes sent to the destination.
+        --fill: registers a batch of fills on one side of one exchange with its fees.
+        --mark: metrics of the tick at the given mid-price (columns of data.METRICS): mid, the
+          mark-to-market P&L, its drawdown from the running peak and the maximum one, the inventory
+          (net tokens over the initial ones), the destination inventory (net tokens of the maker
+          fills alone, the leg left unhedged if the origin hedges are missed) and its average entry
+          price (average cost), the ratio of destination volume filled to volume quoted, the fees
+          paid and the fee drag (fees per unit of traded notional).
+    """
+    __slots__ = ('fiat', 'token', 'dest_inventory', 'dest_vwap', 'quoted', 'filled', 'fees', 'notional',
+                 'peak', 'max_drawdown')
+
+    def __init__(self, fiat: float, token: float):
+        self.fiat, self.token = fiat, token
+        self.dest_inventory, self.dest_vwap = 0., np.nan
+        self.quoted = self.filled = self.fees = self.notional = 0.
+        self.peak, self.max_drawdown = -np.inf, 0.
+
+    def sent(self, volume: float):
+        self.quoted += volume
+
+    def fill(self, size: float, notional: float, fee: float, dest: bool):
+        # size is signed (positive when buying); the hedges on the origin flatten the total inventory,
+        # so the average cost follows the destination fills and only moves when their inventory grows
+        # or flips side
+        if size == 0:
+            return
+        self.fees += fee
+        self.notional += notional
+        if not dest:
+            return
+        self.filled += abs(size)
+        held = self.dest_inventory
+        inventory = held + size
+        if held == 0 or (held > 0) == (size > 0):
+            self.dest_vwap = ((0. if held == 0 else self.dest_vwap*abs(held)) + notional) / abs(inventory)
+        elif (inventory > 0) != (held > 0):
+            self.dest_vwap = notional / abs(size)
+        self.dest_inventory = 0. if abs(inventory) < 1e-9 else inventory
+        if self.dest_inventory == 0:
+            self.dest_vwap = np.nan
+
+    def mark(self, mid: float, fiat: float, token: float) -> tuple:
+        pnl = fiat - self.fiat + (token - self.token)*mid
+        self.peak = max(self.peak, pnl)
+        drawdown = self.peak - pnl
+        self.max_drawdown = max(self.max_drawdown, drawdown)
+        return (mid, pnl, drawdown, self.max_drawdown, token - self.token, self.dest_inventory, self.dest_vwap,
+                self.filled / self.quoted if self.quoted else np.nan, self.fees,
+                self.fees / self.notional if self.notional else np.nan)
+
+
+# XEMM attributes holding the state of a run (XEMM.checkpoint); the results live in the store
+_CHECKPOINT_STATE = ('fiat_bal_dest', 'token_bal_dest', 'fiat_bal_origin', 'token_bal_origin', 'events',
+                     '_origins', '_bit', '_dest_ts', '_dest_levels', '_queues', '_initial_balances', 'rng',
+                     '_draw_source', '_origin_mid', 'metrics', '_steps')
+
 
 class XEMM:
     """
     This class allows to create objects of processes of the XEMM according to the origin and destination 
     orderbooks, the cash and token balance and the fees.
 
+    The simulation is event driven: origin updates, destination updates, order arrivals and hedge
+    executions are timestamped events popped from an EventQueue, so replicated orders reach the
+    destination book after their transaction time and may land before or after a destination update.
+
     Parameters:
     -----------
         ob_krak: origin orderbook (dict)
@@ -31,21 +752,61 @@ class XEMM:
         fee_taker_origin: taker position fee of the origin (float) (default = 0.002)
         fee_maker_origin: maker position fee of the origin (float) (default = 0.001)
         rebal_threshold: proportion of minimum balance value (float) (default = 0.10)
+        snapshots: aligned (origin_timestamp, origin_snapshot, dest_timestamps, dest_snapshots) stream,
+          with every destination update since the previous origin snapshot, e.g. data.iter_jsonOB,
+          used instead of ob_krak and ob_bit; tuples may end with the origin venue when hedging on
+          several, e.g. data.iter_venues; the destination may come as level deltas, e.g.
+          data.iter_deltaOB (iterable) (default = None)
+        latency_limit: milliseconds a replicated order may take to reach the destination exchange,
+          median timedelta between destination updates (float) (default = 1500)
+        profiler: records the time spent in each phase of every snapshot, e.g. profiling.Profiler
+          (default = None, no instrumentation)
+        origin_tick: tick size of the origin exchange, e.g. data.TICK_SIZES['kraken'] (float)
+          (default = None, float prices)
+        dest_tick: tick size of the destination exchange; replicated bids are rounded down and asks
+          up onto it (float) (default = None, float prices)
+        dest_lot: lot size of the destination exchange; replicated volumes are rounded down onto it
+          (float) (default = None)
+        origin_fees: taker and maker fees of each origin venue, {venue: (fee_taker, fee_maker)}; levels
+          are replicated from the best bid and ask among the origin venues and hedged on the venue
+          with the best top net of fees (dict) (default = fee_taker_origin and fee_maker_origin)
+        rng: random generator of the transaction times; every quote round gets its own draws,
+          uniform between 1 and 250 ms, taken from blocks of draw_block draws (np.random.Generator)
+          (default = None, every round gets the same fixed draw)
+        draw_block: transaction times drawn at once from rng (int) (default = 65,536)
+        fill_model: how the XEMM levels resting on the destination are filled on its updates; 'top', every
+          level the next top of book trades through is filled whole, or 'queue', the XEMM volume of a
+          level joins the back of its queue and is filled by the exchange volume leaving the level
+          once the volume ahead of it (FIFO) is gone, or whole when the level is traded through (str)
+          (default = 'top')
+        store: columnar store the balances, fees, fills and orderbooks are written to, e.g.
+          data.ResultsStore(depth=20, sample_every=100, path='results') to keep one full orderbook
+          every 100 destination updates and stream the tables to disk; checkpoints need one streaming
+          to disk (data.ResultsStore) (default = None, a new in-memory store keeping every orderbook
+          each run)
 
     Methods:
     --------
-        --origin_destination_alignment: aligns the destination timestaps after the origin ones.
+        --origin_destination_alignment: pairs each origin snapshot with the latest destination one.
+        --step: advances the simulation by one origin/destination snapshot pair (online mode).
+        --results: balances, fees, histories and orderbooks stored so far.
+        --checkpoint: writes the state of the run to a binary file.
+        --restore: continues a run from a checkpoint.
         --cross_exchange_market_making: implements all the processes of the cross exchange market-making. 
           It updates the balances and adds levels.
     """
-    def __init__(self, ob_krak: dict, ob_bit: dict, bp: int=10, prcnt: float=1,
+    def __init__(self, ob_krak: dict=None, ob_bit: dict=None, bp: int=10, prcnt: float=1,
                  fiat_bal_dest: float=1000000, token_bal_dest: float=100,
                  fiat_bal_origin: float=1000000, token_bal_origin: float=100,
                  fee_taker_dest: float=.003, fee_maker_dest: float=.0015,
                  fee_taker_origin: float=.002, fee_maker_origin:float=.001, 
-                 rebal_threshold:float=.10):
+                 rebal_threshold:float=.10, snapshots=None, latency_limit: float=1500,
+                 profiler=None, origin_tick: float=None, dest_tick: float=None, dest_lot: float=None,
+                 origin_fees: dict=None, store: dt.ResultsStore=None, rng: np.random.Generator=None,
+                 draw_block: int=1 << 16, fill_model: str='top'):
         self.ob_krak = ob_krak
         self.ob_bit = ob_bit
+        self.snapshots = snapshots
         self.bp = bp
         self.prcnt = prcnt
         self.fiat_bal_dest = fiat_bal_dest
@@ -59,458 +820,971 @@ class XEMM:
         self.initial_fiat = fiat_bal_dest
         self.initial_token = token_bal_dest
         self.rebal_threshold = rebal_threshold
+        self.latency_limit = latency_limit
+        self.origin_tick = origin_tick
+        self.dest_tick = dest_tick
+        self.dest_lot = dest_lot
+        self.origin_fees = origin_fees or {}
+        self._store = store
+        self.rng = rng
+        self.draw_block = draw_block
+        if fill_model not in ('top', 'queue'):
+            raise ValueError(f"fill_model must be 'top' or 'queue', not {fill_model!r}")
+        self.fill_model = fill_model
+        self.profiler = profiler
+        if profiler is not None:
+            self.step = profiler.wrap('step', self.step)
+            self._reconcile_books = profiler.wrap('reconcile', self._reconcile_books)
+        self._reset()
+
+
+    def origin_destination_alignment(self) -> tuple:
+        """
+        This function aligns the timestamps of the origin and destination orderbooks: each origin
+        snapshot is paired with the latest destination snapshot at or before it (as-of alignment)
+        over int64 nanosecond timestamp indexes.
 
+        Parameters:
+        -----------
+            Already defined in the class constructor.
 
-    def origin_destination_alignment(self) -> list.pop:
+        Returns:
+        --------
+            Positions of the aligned origin snapshots and of their destination snapshots (np.ndarray).
+        """
+        origin_ts = dt.timestamp_index(self.ob_krak.keys())
+        dest_ts = dt.timestamp_index(self.ob_bit.keys())
+        return dt.asof_alignment(origin_ts, dest_ts)
+
+
+    def _snapshot_pairs(self):
+        # aligned origin/destination snapshots, streamed or taken from the orderbook dicts
+        if self.snapshots is not None:
+            return iter(self.snapshots)
+
+        # materialize the snapshots once and walk them aligned with a cursor
+        return dt.iter_columns(dt.to_columns(self.ob_krak.items()), dt.to_columns(self.ob_bit.items()))
+
+
+    def _reset(self):
+        # event queue, current books and storing variables of a simulation run
+        self.events = EventQueue()
+        self._handlers = {ORIGIN_UPDATE: self._on_origin_update, DEST_UPDATE: self._on_dest_update,
+                          ORDER_ARRIVAL: self._on_order_arrivals, HEDGE: self._on_hedge}
+        if self.profiler is not None:
+            self._handlers = {kind: self.profiler.wrap(_PHASES[kind], handler)
+                              for kind, handler in self._handlers.items()}
+        self._origins = {}
+        self._bit = None
+        self._dest_ts = None
+        self._tick = None
+
+        self.store = self._store if self._store is not None else dt.ResultsStore()
+        self._dest_levels = None
+        self._queues = {True: (np.empty(0), np.empty(0)), False: (np.empty(0), np.empty(0))}
+        self._initial_balances = (self.fiat_bal_dest, self.token_bal_dest,
+                                  self.fiat_bal_origin, self.token_bal_origin)
+        self._draws = np.empty(0)
+        self._draw_source = None
+        self._origin_mid = np.nan
+        self._steps = 0
+        self.metrics = RunningMetrics(self.fiat_bal_dest + self.fiat_bal_origin,
+                                      self.token_bal_dest + self.token_bal_origin)
+
+
+    def _run_until(self, time: int):
+        # process every scheduled event up to (and including) the given timestamp
+        events = self.events
+        while len(events) and events.peek_time() <= time:
+            event_time, kind, payload = events.pop()
+            if kind == ORDER_ARRIVAL:
+                # consecutive arrivals meet the same destination OB and are handled together
+                payload = [(event_time, payload)]
+                while len(events) and events.peek() == ORDER_ARRIVAL and events.peek_time() <= time:
+                    payload.append(events.pop()[::2])
+            self._handlers[kind](event_time, payload)
+
+
+    def _best_origin(self, is_bid: bool, maker: bool=False) -> tuple:
+        # origin venue with the best top net of its fee (highest bid to sell, lowest ask to buy):
+        # (venue, book side, fee)
+        best = None
+        for venue, book in self._origins.items():
+            side = book.bid if is_bid else book.ask
+            fee = self.origin_fees.get(venue, (self.fee_taker_origin, self.fee_maker_origin))[maker]
+            net = side.top()*(1 - fee) if is_bid else -side.top()*(1 + fee)
+            if best is None or np.isnan(best[0]) or net > best[0]:
+                best = (net, venue, side, fee)
+        return best[1:]
+
+
+    def _on_origin_update(self, time: int, update: tuple):
+        # new origin OB: replicate the best origin levels near the mid and send them to the destination
+        venue, snapshot = update
+        self._origins[venue] = OrderBook.from_snapshot(snapshot, self.origin_tick)
+        krak_bid = self._best_origin(True)[1]
+        krak_ask = self._best_origin(False)[1]
+        mid_krak = (krak_bid.top() + krak_ask.top()) / 2
+        self._origin_mid = mid_krak
+        upper_krak = mid_krak*(1 + self.bp / 10000)
+        lower_krak = mid_krak*(1 - self.bp / 10000)
+
+        n_bids = krak_bid.better_than(lower_krak)
+        n_asks = krak_ask.better_than(upper_krak)
+        price = np.concatenate([krak_bid.price[:n_bids], krak_ask.price[:n_asks]])
+        size = np.concatenate([krak_bid.size[:n_bids], krak_ask.size[:n_asks]]) * self.prcnt
+        is_bid = np.arange(n_bids + n_asks) < n_bids
+
+        # quotes must be on the destination's tick and lot grids (passive side of the tick)
+        if self.dest_tick is not None:
+            price = np.where(is_bid, _to_grid(price, self.dest_tick, np.floor),
+                             _to_grid(price, self.dest_tick, np.ceil))
+        if self.dest_lot is not None:
+            size = _to_grid(size, self.dest_lot, np.floor)
+            price, size, is_bid = price[size > 0], size[size > 0], is_bid[size > 0]
+
+        # sort queue by transaction time and cut it by the latency limit
+        queue, elapsed_time = self._draw_queue(len(price))
+        quoted = size[queue].sum()
+        self.store.add_quoted(time, quoted)
+        self.metrics.sent(quoted)
+        if not len(queue):
+            return
+
+        # orders arrive one after the other; their taker fills are hedged once the last one arrived
+        fills = []
+        quotes = self._tick['quotes']
+        arrival = time + (elapsed_time*1e6).astype(np.int64)
+        for i, arrival_time in zip(queue, arrival):
+            quotes.append((arrival_time, price[i], size[i], is_bid[i]))
+            self.events.push(arrival_time, ORDER_ARRIVAL, (price[i], size[i], is_bid[i], fills))
+        self.events.push(arrival[-1], HEDGE, fills)
+
+
+    def _draw_queue(self, n_levels: int) -> tuple:
+        # transaction queue of a quote round, from the next draws of the generator when there is one
+        if self.rng is None:
+            return _transaction_queue(n_levels, self.latency_limit)
+        if n_levels > len(self._draws):
+            # generator state before the block, draws left before it and its size (checkpoints)
+            size = max(n_levels - len(self._draws), self.draw_block)
+            self._draw_source = (self.rng.bit_generator.state, self._draws.copy(), size)
+            self._draws = np.concatenate([self._draws, self.rng.uniform(1, 250, size=size)])
+        transaction_time, self._draws = self._draws[:n_levels], self._draws[n_levels:]
+        return _queue(transaction_time, self.latency_limit)
+
+
+    def _take(self, time: int, order: tuple) -> bool:
+        # replicated order crossing the destination OB is filled as taker (False if it does not cross)
+        price, size, is_bid, fills = order
+        bit = self._bit
+        if is_bid:
+            bit_ask = bit.ask.top()
+            if not price >= bit_ask:
+                return False
+            bit.ask.consume(size)
+            self._register_take(time, order, bit_ask)
+
+        else:
+            bit_bid = bit.bid.top()
+            if not price < bit_bid:
+                return False
+            bit.bid.consume(size)
+            self._register_take(time, order, bit_bid)
+
+        return True
+
+
+    def _register_take(self, time: int, order: tuple, top: float):
+        # fees, balances and fills of a taker order filled at the given destination top
+        _, size, is_bid, fills = order
+        # register fees paid
+        fee = size*top*self.fee_taker_dest
+        self.store.add_fee(time, False, fee)
+        self.metrics.fill(size if is_bid else -size, size*top, fee, True)
+        # register effects on balances
+        if is_bid:
+            self.fiat_bal_dest += -fee - (size*top)
+            self.token_bal_dest += size
+        else:
+            self.fiat_bal_dest += -fee + (size*top)
+            self.token_bal_dest += -size
+
+        fills.append((size, is_bid))
+        self._tick['fills'].append((time, top, size, is_bid))
+        self.store.add_fill(time, False, top, size, is_bid)
+
+
+    def _on_order_arrival(self, time: int, order: tuple):
+        # replicated order reaches the destination OB: taker if it crosses the book, maker otherwise
+        if not self._take(time, order):
+            price, size, is_bid, _ = order
+            (self._bit.bid if is_bid else self._bit.ask).insert(price, size)
+
+
+    def _on_order_arrivals(self, time: int, arrivals: list):
+        """
+        Consecutive order arrivals, as (time, order) pairs in queue order. They are classified with
+        one comparison against the tops of the destination OB; the orders crossing it are filled one
+        after the other (each fill moves the top away) and the makers are inserted in one batch per
+        side. Batches where an order could interact with another one (crossing quotes, both sides
+        taking, or takers reaching the depth where makers go) go through the sequential kernel
+        (OrderBook.arrivals), so the result is always that of the sequential queue. With numba
+        installed (USE_KERNEL) every batch goes through the compiled kernel.
+        """
+        if len(arrivals) == 1:
+            return self._on_order_arrival(*arrivals[0])
+
+        bit = self._bit
+        orders = [order for _, order in arrivals]
+        price = np.array([order[0] for order in orders])
+        size = np.array([order[1] for order in orders])
+        is_bid = np.array([order[2] for order in orders], dtype=bool)
+        taker = np.where(is_bid, price >= bit.ask.top(), price < bit.bid.top())
+
+        bids, asks = price[is_bid], price[~is_bid]
+        sequential = USE_KERNEL or (len(bids) and len(asks) and bids.max() >= asks.min())
+        if not sequential and taker.any():
+            if (taker & is_bid).any() and (taker & ~is_bid).any():
+                sequential = True
+            else:
+                # deepest level the takers could reach on the side they consume, makers must rest beyond
+                taken, makers = (bit.ask, ~is_bid) if taker[is_bid].any() else (bit.bid, is_bid)
+                depth = np.searchsorted(np.cumsum(taken.size), size[taker].sum(), side='left')
+                sequential = depth >= len(taken) or (taken.to_key(price[makers]) <= taken.key[depth]).any()
+
+        if sequential:
+            top = bit.arrivals(price, size, is_bid)
+            for i in np.flatnonzero(~np.isnan(top)):
+                self._register_take(*arrivals[i], top[i])
+            return
+
+        for i in np.flatnonzero(taker):
+            taker[i] = self._take(*arrivals[i])
+        maker_bid, maker_ask = ~taker & is_bid, ~taker & ~is_bid
+        if maker_bid.any():
+            bit.bid.insert_many(price[maker_bid], size[maker_bid])
+        if maker_ask.any():
+            bit.ask.insert_many(price[maker_ask], size[maker_ask])
+
+
+    def _on_hedge(self, time: int, fills: list):
+        # Hedge transactions in origin exchange (Kraken): every taker fill of the queue at once, on
+        # the best origin venue of each side
+        if not fills:
+            return
+        size = np.array([vol for vol, _ in fills])
+        hedge_bid = np.array([bid for _, bid in fills])
+        krak_top = np.empty(len(fills))
+        fee_rate = np.empty(len(fills))
+        venue = np.empty(len(fills), dtype=object)
+        if hedge_bid.any():
+            venue[hedge_bid], krak_bid, fee_rate[hedge_bid] = self._best_origin(True)
+            krak_top[hedge_bid] = krak_bid.consume(size[hedge_bid])[1]
+        if (~hedge_bid).any():
+            venue[~hedge_bid], krak_ask, fee_rate[~hedge_bid] = self._best_origin(False)
+            krak_top[~hedge_bid] = krak_ask.consume(size[~hedge_bid])[1]
+
+        # register fees paid and effects on balances
+        fees = size*krak_top*fee_rate
+        self.store.add_fees(time, True, fees)
+        for hedges, sign in ((hedge_bid, -1.), (~hedge_bid, 1.)):
+            # hedges on the origin bids sell, on the asks buy
+            if hedges.any():
+                self.metrics.fill(sign*size[hedges].sum(), (size*krak_top)[hedges].sum(), fees[hedges].sum(), False)
+        self.store.add_fills(time, True, krak_top, size, ~hedge_bid)
+        self._tick['hedges'].extend(zip(itertools.repeat(time), krak_top, size, ~hedge_bid, venue))
+        for fee, vol, krak_price, bid in zip(fees, size, krak_top, hedge_bid):
+            if bid:
+                self.fiat_bal_origin += -fee + (vol*krak_price)
+                self.token_bal_origin += -vol
+            else:
+                self.fiat_bal_origin += -fee - (vol*krak_price)
+                self.token_bal_origin += vol
+
+
+    def _apply_dest_deltas(self, deltas: dt.Deltas) -> dict:
+        """
+        Splices the level changes of a destination update into the live destination levels, kept as
+        an OrderBook without XEMM volume. Returns, per side (True for bids), the keys and volumes after
+        the update (views of the live levels, valid until the next update) and the changed keys.
         """
-        This function aligns the timestamps of the origin and destination orderbooks.
+        if self._dest_levels is None:
+            self._dest_levels = OrderBook.from_snapshot(dt.Snapshot(*np.empty((4, 0))), self.dest_tick)
+        levels = {}
+        for is_bid, side in ((True, self._dest_levels.bid), (False, self._dest_levels.ask)):
+            rows = deltas.is_bid == is_bid
+            delta_key = side.to_key(deltas.price[rows])
+            order = np.argsort(delta_key, kind='stable')
+            delta_key = delta_key[order]
+            side.splice(delta_key, deltas.size[rows][order])
+            levels[is_bid] = (side.key, side.size, delta_key)
+        return levels
+
+
+    def _on_dest_update(self, time: int, update: tuple):
+        # new destination OB: fill the XEMM levels it trades through and merge it with them
+        dest_ts, snapshot = update
+        bit = self._bit
+        if isinstance(snapshot, dt.Deltas):
+            # only the changed levels are applied to the live destination levels
+            next_bit = self._apply_dest_deltas(snapshot)
+            live = self._dest_levels
+            if bit is None:
+                self._bit = OrderBook(*(BookSide(side.price, side.size, name, tick=self.dest_tick)
+                                        for side, name in ((live.bid, 'bid'), (live.ask, 'ask'))))
+                for side in (self._bit.bid, self._bit.ask):
+                    # exchange levels without volume are dropped by the first reconcile
+                    side.unstable = side.key[side.size == 0]
+                return
+            new_tob = (live.bid.top(), live.ask.top())
+        else:
+            next_bit = OrderBook.from_snapshot(snapshot, self.dest_tick)
+            if bit is None:
+                self._bit = next_bit
+                return
+            new_tob = (next_bit.bid.top(), next_bit.ask.top())
+
+        store = self.store
+        if store.sample():
+            store.add_book(dest_ts, bit.to_frame())
+        levels = bit.levels(store.depth)
+
+        # levels to drop after comparison with next destination TOB
+        n_bids = bit.bid.better_than(new_tob[0])
+        n_asks = bit.ask.better_than(new_tob[1])
+        if self.fill_model == 'queue':
+            next_levels = ({True: (next_bit.bid.key, next_bit.bid.size), False: (next_bit.ask.key, next_bit.ask.size)}
+                           if isinstance(next_bit, OrderBook) else
+                           {is_bid: side_levels[:2] for is_bid, side_levels in next_bit.items()})
+            bids_price, bids_size = self._queue_fills(True, n_bids, *next_levels[True])
+            asks_price, asks_size = self._queue_fills(False, n_asks, *next_levels[False])
+        else:
+            bids_price, bids_size = bit.bid.price[:n_bids], bit.bid.size[:n_bids]
+            asks_price, asks_size = bit.ask.price[:n_asks], bit.ask.size[:n_asks]
+        _, krak_bid, fee_bid = self._best_origin(True, maker=True)
+        _, krak_ask, fee_ask = self._best_origin(False, maker=True)
+        krak_bid, krak_ask = krak_bid.top(), krak_ask.top()
+        fills = self._tick['fills']
+        fills.extend(zip(itertools.repeat(time), bids_price, bids_size, itertools.repeat(True)))
+        fills.extend(zip(itertools.repeat(time), asks_price, asks_size, itertools.repeat(False)))
+        store.add_fills(time, False, bids_price, bids_size, True)
+        store.add_fills(time, False, asks_price, asks_size, False)
+
+        # Register fees and transaction effects on balances
+        metrics = self.metrics
+        fee = (bids_size*bids_price*self.fee_maker_dest).sum()
+        store.add_fee(time, False, fee)
+        metrics.fill(bids_size.sum(), (bids_price*bids_size).sum(), fee, True)
+        self.fiat_bal_dest += -fee - (bids_price*bids_size).sum()
+        self.token_bal_dest += bids_size.sum()
+        fee = (krak_bid*bids_size*fee_bid).sum()
+        store.add_fee(time, True, fee)
+        metrics.fill(-bids_size.sum(), (krak_bid*bids_size).sum(), fee, False)
+        self.fiat_bal_origin += -fee + (krak_bid*bids_size).sum()
+        self.token_bal_origin += -bids_size.sum()
+
+        fee = (asks_size*asks_price*self.fee_maker_dest).sum()
+        store.add_fee(time, False, fee)
+        metrics.fill(-asks_size.sum(), (asks_price*asks_size).sum(), fee, True)
+        self.fiat_bal_dest += -fee + (asks_price*asks_size).sum()
+        self.token_bal_dest += -asks_size.sum()
+        fee = (krak_ask*asks_size*fee_ask).sum()
+        store.add_fee(time, True, fee)
+        metrics.fill(asks_size.sum(), (krak_ask*asks_size).sum(), fee, False)
+        self.fiat_bal_origin += -fee - (krak_ask*asks_size).sum()
+        self.token_bal_origin += asks_size.sum()
+
+        self._rebalance()
+
+        store.add_snapshot(time, (self.fiat_bal_dest, self.token_bal_dest, self.fiat_bal_origin,
+                                  self.token_bal_origin), levels)
+
+        bit.bid.drop(n_bids)
+        bit.ask.drop(n_asks)
+        self._reconcile_books(next_bit)
+
+
+    def _queue_fills(self, is_bid: bool, n_through: int, next_key: np.ndarray, next_size: np.ndarray) -> tuple:
+        """
+        Queue-position fills of the XEMM volume on one destination side against the exchange's next
+        levels (ascending keys of the side and volumes); the first n_through levels are traded
+        through. A FIFO counter per level keeps the exchange volume queued ahead of the XEMM volume,
+        started as the level's exchange volume when the XEMM joined it, so only the levels holding
+        XEMM volume (found among BookSide.unstable) are visited. Returns the prices and volumes
+        filled, and leaves the rest of the XEMM volume on the side; on a level the exchange removes
+        without trading through it, that volume keeps resting alone at the front of the queue.
+        """
+        side = self._bit.bid if is_bid else self._bit.ask
+        # every level holding XEMM volume is unstable
+        at = np.searchsorted(side.key, side.unstable)
+        at = np.unique(at[at < len(side)])
+        at = at[side.added[at] > 0]
+        key, added = side.key[at], side.added[at]
+        exchange = side.size[at] - added
+        queue_key, queue_ahead = self._queues[is_bid]
+        ahead = np.minimum(_lookup(queue_key, queue_ahead, key, exchange), exchange)
+
+        # volume leaving a level is taken from the front of its queue, then from the XEMM volume
+        next_vol = _lookup(next_key, next_size, key, 0.)
+        decrease = np.maximum(exchange - next_vol, 0.)
+        filled = np.clip(decrease - ahead, 0., added)
+        through = at < n_through
+        filled[through] = added[through]
+        rest = ~through & (filled < added)
+        # the exchange volume of a removed level is gone, so reconcile keeps it as an XEMM level
+        side._size[side._lo + at] = np.where(rest & (next_vol == 0), added - filled, side._size[side._lo + at] - filled)
+        side._added[side._lo + at] -= filled
+
+        self._queues[is_bid] = (key[rest], np.maximum(ahead - decrease, 0.)[rest])
+        fill = filled > 0
+        return side._to_price(key[fill]), filled[fill]
+
+
+    def _reconcile_books(self, next_bit):
+        # generate new OrderBook based on next OB data (modify depth of output OB), from the next
+        # snapshot (OrderBook) or the applied destination deltas (see _apply_dest_deltas)
+        bit = self._bit
+        if isinstance(next_bit, OrderBook):
+            bid = reconcile(bit.bid, next_bit.bid.price, next_bit.bid.size)
+            ask = reconcile(bit.ask, next_bit.ask.price, next_bit.ask.size)
+        else:
+            bid = reconcile_deltas(bit.bid, *next_bit[True])
+            ask = reconcile_deltas(bit.ask, *next_bit[False])
+        self._bit = OrderBook(bid, ask)
+
+
+    def _rebalance(self):
+        # rebalance condition
+        if self.fiat_bal_origin <= self.rebal_threshold*(self.initial_fiat):
+
+            rebal_fiat = self.fiat_bal_dest - self.initial_fiat
+            self.fiat_bal_dest -= rebal_fiat
+            self.fiat_bal_origin += rebal_fiat
+
+            rebal_token = self.token_bal_origin - self.initial_token
+            self.token_bal_dest +=  rebal_token
+            self.token_bal_origin -= rebal_token
+
+
+        elif self.fiat_bal_dest <= self.rebal_threshold*(self.initial_fiat):
+
+
+            rebal_fiat = self.fiat_bal_origin - self.initial_fiat
+            self.fiat_bal_dest += rebal_fiat
+            self.fiat_bal_origin -= rebal_fiat
+
+            rebal_token = self.token_bal_dest - self.initial_token
+            self.token_bal_dest -=  rebal_token
+            self.token_bal_origin += rebal_token
+
+
+    def step(self, origin_ts: str, origin, dest_ts: str, dest, origin_venue: str='origin') -> dict:
+        """
+        Online mode: advances the simulation with the next origin snapshot and the destination
+        snapshots received since the previous call, up to the latest at or before it. Books, balances
+        and fees are kept across calls; every destination snapshot that changed is scheduled as its
+        own update, and the events up to the origin timestamp are processed in time order.
 
         Parameters:
         -----------
-            Already defined in the class constructor.
+            origin_ts: origin snapshot timestamp (str)
+            origin: origin orderbook (data.Snapshot, pd.DataFrame or JSON object)
+            dest_ts: destination snapshot timestamp, or the timestamps of the destination updates
+              since the previous call in time order (str or list)
+            dest: destination orderbook (data.Snapshot, pd.DataFrame or JSON object), or its level
+              changes since the previous destination (data.Deltas, e.g. from data.iter_deltaOB); a
+              list of them when dest_ts is a list
+            origin_venue: origin exchange of the snapshot when hedging on several (str)
 
         Returns:
         --------
-            Aligned destination orderbook after origin.
+            Dictionary with the tick's 'quotes' sent (arrival time, price, size, is_bid), the 'fills'
+            of XEMM orders on the destination (time, price, size, is_bid), the 'hedges' sent to the
+            origin (time, price, size, is_bid, venue), the running 'metrics' after it (dict of
+            data.METRICS, see RunningMetrics) and the wall-clock 'latency' of the call in seconds.
+        """
+        start = perf_counter()
+        if self.profiler is not None:
+            self.profiler.snapshot(origin_ts)
+        self._tick = {'timestamp': origin_ts, 'quotes': [], 'fills': [], 'hedges': []}
+
+        if isinstance(dest_ts, str):
+            dest_ts, dest = [dest_ts], [dest]
+        for update_ts, update in zip(dest_ts, dest):
+            if update_ts == self._dest_ts:
+                continue
+            self._dest_ts = update_ts
+            if not isinstance(update, (dt.Snapshot, dt.Deltas)):
+                update = dt.to_snapshot(update)
+            self.events.push(dt.to_timestamp(update_ts), DEST_UPDATE, (update_ts, update))
+        if not isinstance(origin, dt.Snapshot):
+            origin = dt.to_snapshot(origin)
+        origin_time = dt.to_timestamp(origin_ts)
+        self.events.push(origin_time, ORIGIN_UPDATE, (origin_venue, origin))
+        self._run_until(origin_time)
+        metrics = self.metrics.mark(self._origin_mid, self.fiat_bal_dest + self.fiat_bal_origin,
+                                    self.token_bal_dest + self.token_bal_origin)
+        self.store.add_metrics(origin_time, metrics)
+        self._tick['metrics'] = dict(zip(dt.METRICS, metrics))
+        self._steps += 1
+
+        self._tick['latency'] = perf_counter() - start
+        return self._tick
+
+
+    def results(self) -> dict:
+        """
+        Balances, fees, histories and XEMM orderbooks stored so far (same dictionary as
+        cross_exchange_market_making), read back from the results store; histories start with the
+        initial balances, 'ob_xemm' only holds the sampled orderbooks, 'snapshots' is the table of
+        balances and top levels of every destination update and 'metrics' the table of running P&L,
+        inventory and risk metrics of every tick (data.METRICS).
         """
-        aux = sum(pd.to_datetime(pd.Series((self.ob_bit.keys()))) 
-                  < pd.to_datetime(pd.Series(self.ob_krak.keys()))[0])
-        return [self.ob_bit.pop(key) for key in list(self.ob_bit.keys())[:aux]]
+        store = self.store
+        store.flush()
+        snapshots, fees = store.table('snapshots'), store.table('fees')
+        fiat_dest, token_dest, fiat_origin, token_origin = self._initial_balances
+        self.fiat_hist_dest = np.concatenate([[fiat_dest], snapshots['fiat_bal_dest']])
+        self.fiat_hist_origin = np.concatenate([[fiat_origin], snapshots['fiat_bal_origin']])
+        self.token_hist_dest = np.concatenate([[token_dest], snapshots['token_bal_dest']])
+        self.token_hist_origin = np.concatenate([[token_origin], snapshots['token_bal_origin']])
+        self.token_exposure = self.token_hist_dest + self.token_hist_origin - 2 * self.initial_token
+
+        results = {'fiat_bal_dest': self.fiat_bal_dest, 'token_bal_dest': self.token_bal_dest,
+                   'fiat_bal_origin': self.fiat_bal_origin, 'token_bal_origin': self.token_bal_origin,
+                   'ob_xemm': store.books, 'snapshots': snapshots, 'fees_dest': fees['fee'][~fees['origin']],
+                   'fees_origin': fees['fee'][fees['origin']],
+                   'fiat_hist_dest': self.fiat_hist_dest, 'fiat_hist_origin': self.fiat_hist_origin,
+                   'token_exposure':self.token_exposure, 'metrics': store.table('metrics')}
+
+        return results
 
 
-    def cross_exchange_market_making(self) -> dict:
+    @property
+    def size_to_fill_hist(self) -> np.ndarray:
+        # volume quoted on the destination for every origin update
+        return self.store.table('quoted')['volume']
+
+
+    def checkpoint(self, file_path: str, run: str = 'single'):
+        """
+        Writes the state of the run after the last step (books with the XEMM levels, events in flight,
+        balances, running metrics and random generator state) to a binary file, with the rows of every
+        table of the results store. The results themselves are not copied: the store must stream them
+        to disk (data.ResultsStore with a path), and it is flushed so every row counted is on disk.
+        Only the live levels of the books are written, and the pending transaction time draws as the
+        generator state they were drawn from, so the file size does not grow with the run. The
+        directory of the store and the kind of run ('single', or 'chain' and 'shard' for sharded_xemm)
+        are written too, so it is only restored into the same run.
+        """
+        store = self.store
+        if store.path is None:
+            raise ValueError('checkpoints need a results store streaming to disk, e.g. '
+                             "data.ResultsStore(path='results')")
+        store.flush()
+        state = {name: getattr(self, name) for name in _CHECKPOINT_STATE}
+        state['draws_left'] = len(self._draws)
+        state['run'] = run
+        state['store'] = {'path': os.path.abspath(store.path), 'depth': store.depth,
+                          'chunk_size': store.chunk_size, 'offsets': store.offsets()}
+        with open(file_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+    def restore(self, file_path: str, run: str = 'single'):
+        """
+        Continues the run saved in a checkpoint: the following steps give the same results as the run
+        that wrote it. The XEMM must be built with the same parameters and a results store on the
+        same directory, which is truncated to the rows it had at the checkpoint, and the checkpoint
+        must have been written by the same kind of run (see checkpoint).
+        """
+        self._reset()
+        with open(file_path, 'rb') as f:
+            state = pickle.load(f)
+        if state['run'] != run:
+            raise ValueError(f"{file_path} was written by a {state['run']!r} run, not a {run!r} one")
+        store, saved = self.store, state['store']
+        if store.path is None or ((os.path.abspath(store.path), store.depth, store.chunk_size)
+                                  != (saved['path'], saved['depth'], saved['chunk_size'])):
+            raise ValueError(f"restoring {file_path} needs the results store it was written with (path "
+                             f"{saved['path']!r}, depth {saved['depth']}, chunk_size {saved['chunk_size']})")
+        store.truncate(saved['offsets'])
+        for name in _CHECKPOINT_STATE:
+            setattr(self, name, state[name])
+        if self._draw_source is not None:
+            # the pending draws are drawn again from the generator state they came from
+            bit_state, draws, size = self._draw_source
+            generator = np.random.Generator(getattr(np.random, bit_state['bit_generator'])())
+            generator.bit_generator.state = bit_state
+            draws = np.concatenate([draws, generator.uniform(1, 250, size=size)])
+            self._draws = draws[len(draws) - state['draws_left']:]
+
+
+    def cross_exchange_market_making(self, resume: str=None, checkpoint: str=None,
+                                     checkpoint_every: int=0) -> dict:
         """
         This function adds levels from the origin orderbook to the destination one. Additionally, it
         consumes the levels if they are traded. Moreover, it saves the payed fees and updates the balances.
 
+        Batch mode: a loop of step over the aligned snapshot pairs. Orders still travelling when the
+        data ends are not executed.
+
         Parameters:
         -----------
-            Already defined in the class constructor.
+            resume: checkpoint of an interrupted run over the same snapshots; the snapshot pairs it
+              already stepped through are skipped (str) (default = None, new run)
+            checkpoint: file the state of the run is written to (see checkpoint; the store must
+              stream to disk) at the end and every checkpoint_every snapshots (str) (default = None)
+            checkpoint_every: snapshots between checkpoints, 0 for the end only (int) (default = 0)
+            Others already defined in the class constructor.
 
         Returns:
         --------
             Dictionary containing the orderbooks with the levels added and the balances.
         """
-        # Orderbook aligment
-        self.origin_destination_alignment()
-
-        # Storing variables
-        ob_xemm = {}
-        bids_to_fill_hist = []
-        asks_to_fill_hist = []
-        size_to_fill_hist = []
-
-        fiat_hist_dest = [self.fiat_bal_dest]
-        fiat_hist_origin = [self.fiat_bal_origin]
-        token_hist_dest = [self.token_bal_dest]
-        token_hist_origin = [self.token_bal_origin]
-
-        fees_dest = []
-        fees_origin = []
-        latency_limit = 1500 # median timedelta between OB updates in destination exchange
-
-        # Origin OB
-        df_krak = self.ob_krak[list(self.ob_krak.keys())[0]]
-        mid_krak = (df_krak['bid'][0] + df_krak['ask'][0]) / 2
-
-        # Destination OB
-        df_bit = self.ob_bit[list(self.ob_bit.keys())[0]]
-        bit_ask = df_bit[['ask', 'ask_size']]
-        bit_bid = df_bit[['bid_size', 'bid']]
-        bit_ask['ask_added_vol'] = np.zeros(bit_ask.shape[0])
-        bit_bid['bid_added_vol'] = np.zeros(bit_bid.shape[0])
-
-        for t in range(len(self.ob_krak.keys())-1):
-            krak_bid = df_krak[['bid_size', 'bid']]
-            krak_ask = df_krak[['ask', 'ask_size']]
-            
-            upper_krak = mid_krak*(1 + self.bp / 10000)
-            lower_krak = mid_krak*(1 - self.bp / 10000)
-            
-            bids_krak = df_krak[df_krak['bid'] > lower_krak][['bid', 'bid_size']]
-            asks_krak = df_krak[df_krak['ask'] < upper_krak][['ask', 'ask_size']]
-            levels = pd.concat([bids_krak, asks_krak], axis = 1)
-            
-            # replicate origin levels on destination
-            bid_levels = levels[['bid_size', 'bid']]
-            bid_levels['bid_flag'] = ['bid'] * bid_levels.shape[0]
-            bid_levels.rename(columns={'bid_size':'size',
-                                    'bid':'price',
-                                    'bid_flag':'type'}, inplace=True)
-            bid_levels['size'] = bid_levels['size']*self.prcnt
-            
-            ask_levels = levels[['ask_size', 'ask']]
-            ask_levels['ask_flag'] = ['ask'] * ask_levels.shape[0]
-            ask_levels.rename(columns={'ask_size':'size',
-                                    'ask':'price',
-                                    'ask_flag':'type'}, inplace=True)
-            ask_levels['size'] = ask_levels['size'] * self.prcnt
-            
-            levels_added = bid_levels.append(ask_levels, ignore_index=True).dropna()
-            np.random.seed(123)
-            
-            # sort queue by transaction time
-            levels_added['transaction_time'] = np.random.uniform(250, size=levels_added.shape[0])
-            levels_added.sort_values(by='transaction_time', inplace=True, ignore_index=True)
-            
-            
-            # cut list of levels_added by a specified latency limit
-            levels_added['elapsed_time'] = levels_added['transaction_time'].cumsum()
-            to_drop = levels_added[levels_added['elapsed_time'] > latency_limit]
-            levels_added.drop(to_drop.index, inplace=True)
-            levels_added.drop('elapsed_time', axis=1, inplace=True)
-            levels_added.reset_index(drop=True, inplace=True)
-            
-            size_to_fill_hist.append(levels_added['size'].sum())
-            
-            for i in range(levels_added.shape[0]): # loop to add levels unto destination
-                to_fill = levels_added.iloc[0,:]
-
-                if to_fill['type']=='bid':
-                    # identify order's fee structure
-                    fee_type = 'taker' if to_fill['price'] >= bit_ask.iloc[0]['ask'] else 'maker'
-
-
-                    if fee_type=='taker':
-                        
-                        # register fees paid
-                        fees_dest.append(to_fill['size']*bit_ask['ask'][0]*self.fee_taker_dest)
-                        fees_origin.append(to_fill['size']*krak_bid['bid'][0]*self.fee_taker_origin)
-                        # register effects on balances
-                        self.fiat_bal_dest += -fees_dest[-1] - (to_fill['size']*bit_ask['ask'][0])
-                        self.fiat_bal_origin += -fees_origin[-1] + (to_fill['size']*krak_bid['bid'][0])
-                        self.token_bal_dest += to_fill['size']
-                        self.token_bal_origin += -to_fill['size']
-
-                        bit_ask['accum_size'] = bit_ask['ask_size'].cumsum()
-
-                        vol_to_fill = to_fill['size']
-                        bit_ask['remaining_vol'] = vol_to_fill - bit_ask['accum_size']
-                        to_drop = bit_ask[bit_ask['remaining_vol'] > 0]
-
-                        bit_ask.drop(to_drop.index, inplace=True)
-                        bit_ask.reset_index(drop=True, inplace=True)
-
-                        new_vol = -bit_ask.iloc[0,-1]  # remaing volume on surviving level
-
-                        bit_ask.iloc[0,1] = new_vol
-                        bit_ask.drop(['accum_size', 'remaining_vol'], axis=1, inplace=True) 
-                        bit_ask.reset_index(drop=True, inplace=True)
-
-                        levels_added.drop(0, inplace=True)
-                        levels_added.reset_index(drop=True, inplace=True)
-
-                        # Hedge transaction in orgin exchange (Kraken)
-
-                        krak_bid['accum_size'] = krak_bid['bid_size'].cumsum()
-                        krak_bid['remaining_vol'] = vol_to_fill - krak_bid['accum_size']
-                        to_drop = krak_bid[krak_bid['remaining_vol']>0]
-                        
-                        krak_bid.drop(to_drop.index, inplace=True)
-                        krak_bid.reset_index(drop=True, inplace=True)
-
-                        new_vol = -krak_bid.iloc[0,-1] # remaing volume on surviving level
-
-                        krak_bid.iloc[0,0] = new_vol
-                        krak_bid.drop(['accum_size','remaining_vol'], axis=1, inplace=True)
-                        krak_bid.reset_index(drop=True, inplace=True)
-
-                    else:
-
-                        bit_bid.rename(columns={'bid_size':'size','bid':'price'}, inplace=True)
-
-                        to_fill = pd.DataFrame(to_fill).transpose()
-                        to_fill['bid_added_vol'] = to_fill['size'].values
-
-                        bit_bid = bit_bid.merge(to_fill[['size','price','bid_added_vol']], 
-                                                on=['size','price','bid_added_vol'], how='outer'
-                                            ).sort_values(by='price', ascending=False, ignore_index=True) 
-
-                        bit_bid.rename(columns={'size':'bid_size','price':'bid'}, inplace=True)
-                        bit_bid = bit_bid.groupby('bid', as_index=False, sort=False).sum()
-                        bit_bid = bit_bid.reindex(columns=['bid_added_vol', 'bid_size', 'bid'])
-
-
-                        levels_added.drop(0, inplace=True)
-                        levels_added.reset_index(drop=True, inplace=True)
+        if resume is None:
+            self._reset()
+        else:
+            self.restore(resume)
+        for update in itertools.islice(self._snapshot_pairs(), self._steps, None):
+            self.step(*update)
+            if checkpoint is not None and checkpoint_every and self._steps % checkpoint_every == 0:
+                self.checkpoint(checkpoint)
+        if checkpoint is not None:
+            self.checkpoint(checkpoint)
 
-                else:
+        return self.results()
 
-                    # identify order's fee structure
-                    fee_type = 'taker' if to_fill['price'] < bit_bid.iloc[0]['bid'] else 'maker'            
-
-                    if fee_type == 'taker':
-                        
-                        # register paid fees
-                        fees_dest.append(to_fill['size']*bit_bid['bid'][0]*self.fee_taker_dest)
-                        fees_origin.append(to_fill['size']*krak_ask['ask'][0]*self.fee_taker_origin)
-                        # register effects on balances
-                        self.fiat_bal_dest += -fees_dest[-1] + (to_fill['size']*bit_bid['bid'][0])
-                        self.fiat_bal_origin += -fees_origin[-1] - (to_fill['size']*krak_ask['ask'][0])
-                        self.token_bal_dest += -to_fill['size']
-                        self.token_bal_origin += to_fill['size']
-
-                        bit_bid['accum_size'] = bit_bid['bid_size'].cumsum()
-
-
-                        vol_to_fill = to_fill['size']
-
-                        bit_bid['remaining_vol'] = vol_to_fill - bit_bid['accum_size']
-                        to_drop = bit_bid[bit_bid['remaining_vol']>0]
-
-                        bit_bid.drop(to_drop.index, inplace=True)
-                        bit_bid.reset_index(drop=True, inplace=True)
-
-                        new_vol = -bit_bid.iloc[0,-1] # remaing volume on surviving level
-
-                        bit_bid.iloc[0,0] = new_vol
-                        bit_bid.drop(['accum_size','remaining_vol'], axis=1, inplace=True)
-                        bit_bid.reset_index(drop=True, inplace=True)
-
-                        levels_added.drop(0, inplace=True)
-                        levels_added.reset_index(drop=True, inplace=True)
-
-                        # Hedge transaction in origin market (Kraken)
-                        krak_ask['accum_size'] = krak_ask['ask_size'].cumsum()
-                        krak_ask['remaining_vol'] = vol_to_fill - krak_ask['accum_size']
-                        to_drop = krak_ask[krak_ask['remaining_vol']>0]
-
-                        krak_ask.drop(to_drop.index, inplace=True)
-                        krak_ask.reset_index(drop=True, inplace=True)
-
-                        new_vol = -krak_ask.iloc[0,-1] # remaing volume on surviving level
-
-                        krak_ask.iloc[0,1] = new_vol
-                        krak_ask.drop(['accum_size','remaining_vol'], axis=1, inplace=True)
-                        krak_ask.reset_index(drop=True, inplace=True)
-
-
-                    else:
-                        bit_ask.rename(columns={'ask_size':'size','ask':'price'}, inplace=True)
-
-                        to_fill = pd.DataFrame(to_fill).transpose()
-                        to_fill['ask_added_vol'] = to_fill['size'].values
-
-                        bit_ask = bit_ask.merge(to_fill[['size','price','ask_added_vol']], 
-                                                on=['size','price','ask_added_vol'], how='outer'
-                                            ).sort_values(by='price', ascending=True, ignore_index=True)               
-                        bit_ask.rename(columns={'size':'ask_size','price':'ask'}, inplace=True)
-                        bit_ask = bit_ask.groupby('ask', as_index=False, sort=False).sum()
-                        bit_ask = bit_ask.reindex(columns=['ask', 'ask_size', 'ask_added_vol'])
-
-
-                        levels_added.drop(0, inplace=True)
-                        levels_added.reset_index(drop=True, inplace=True)
-            
-            ob_xemm[list(self.ob_bit.keys())[t]]  = pd.concat([bit_bid, bit_ask], axis=1)
-            # Destination OB at the following timestamp            
-            next_ob_bit = self.ob_bit[list(self.ob_bit.keys())[t+1]]
-            new_tob = (next_ob_bit.loc['0','bid'], next_ob_bit.loc['0','ask'])
-
-            # levels to drop after comparison with next destination TOB
-            bids_to_drop = bit_bid[bit_bid['bid']>new_tob[0]]
-            asks_to_drop = bit_ask[bit_ask['ask']<new_tob[1]]
-            
-            # Register fees and transaction effects on balances
-            fees_dest.append((bids_to_drop['bid_size']*bids_to_drop['bid']*self.fee_maker_dest).sum())
-            self.fiat_bal_dest += -fees_dest[-1] - (bids_to_drop['bid']*bids_to_drop['bid_size']).sum()
-            self.token_bal_dest += bids_to_drop['bid_size'].sum() 
-            fees_origin.append((krak_bid['bid'][0]*bids_to_drop['bid_size']*self.fee_maker_origin).sum())
-            self.fiat_bal_origin += -fees_origin[-1] + (krak_bid['bid'][0]*bids_to_drop['bid_size']).sum()
-            self.token_bal_origin += -bids_to_drop['bid_size'].sum() 
-            
-            fees_dest.append((asks_to_drop['ask_size']*asks_to_drop['ask']*self.fee_maker_dest).sum())
-            self.fiat_bal_dest += -fees_dest[-1] + (asks_to_drop['ask']*asks_to_drop['ask_size']).sum()
-            self.token_bal_dest += -asks_to_drop['ask_size'].sum() 
-            fees_origin.append((krak_ask['ask'][0]*asks_to_drop['ask_size']*self.fee_maker_origin).sum())
-            self.fiat_bal_origin += -fees_origin[-1] - (krak_ask['ask'][0]*asks_to_drop['ask_size']).sum()
-            self.token_bal_origin += asks_to_drop['ask_size'].sum() 
-            
-            # rebalance condition
-            if self.fiat_bal_origin <= self.rebal_threshold*(self.initial_fiat): 
-                
-                rebal_fiat = self.fiat_bal_dest - self.initial_fiat
-                self.fiat_bal_dest -= rebal_fiat
-                self.fiat_bal_origin += rebal_fiat
-                
-                rebal_token = self.token_bal_origin - self.initial_token
-                self.token_bal_dest +=  rebal_token
-                self.token_bal_origin -= rebal_token
-                
-                
-            elif self.fiat_bal_dest <= self.rebal_threshold*(self.initial_fiat):
-                
-                
-                rebal_fiat = self.fiat_bal_origin - self.initial_fiat
-                self.fiat_bal_dest += rebal_fiat
-                self.fiat_bal_origin -= rebal_fiat
-                
-                rebal_token = self.token_bal_dest - self.initial_token
-                self.token_bal_dest -=  rebal_token
-                self.token_bal_origin += rebal_token
-                
-                
-            fiat_hist_dest.append(self.fiat_bal_dest)
-            fiat_hist_origin.append(self.fiat_bal_origin)
-            token_hist_dest.append(self.token_bal_dest)
-            token_hist_origin.append(self.token_bal_origin)
-
-            bit_bid.drop(bids_to_drop.index, inplace=True)
-            bit_bid.reset_index(drop=True, inplace=True)
-            bit_ask.drop(asks_to_drop.index, inplace=True)
-            bit_ask.reset_index(drop=True, inplace=True)    
-            
-            # Destination after adding origin's levels and comparing to following OB's ToB.
-            bit_ob = pd.concat([bit_bid, bit_ask], axis=1)
-
-            # Destination XEMM output OrderBook
-            bit_bid_new_tob = bit_ob[['bid_added_vol','bid_size','bid']]
-            bit_ask_new_tob = bit_ob[['ask_added_vol','ask_size','ask']]
-
-            # Destination's next OrderBook
-            next_ob_bit_bids = next_ob_bit[['bid_size','bid']]
-            next_ob_bit_asks = next_ob_bit[['ask','ask_size']]
-            next_ob_bit_bids['bid_added_vol'] = np.zeros(next_ob_bit_bids.shape[0]) 
-            next_ob_bit_asks['ask_added_vol'] = np.zeros(next_ob_bit_asks.shape[0]) 
-
-
-            # Origin's next OrderBook
-            next_ob_krak = self.ob_krak[list(self.ob_krak.keys())[t+1]] 
-            next_ob_krak_bids = next_ob_krak[['bid_size','bid']]
-            next_ob_krak_asks = next_ob_krak[['ask_size','ask']]
-            
-                
-            # generate new OrderBook based on next OB data (modify depth of output OB 'bit_ob')
-            
-            # Bids
-            
-            # data prep
-            new_vols_bid = pd.merge(bit_bid_new_tob, next_ob_bit_bids, on=['bid', 'bid_added_vol'], how='outer').fillna(0)
-            new_vols_bid = new_vols_bid.groupby(by='bid', as_index=False, sort=False).sum()
-            new_vols_bid.sort_values(by='bid', ascending=False, ignore_index=True, inplace=True)
-            new_vols_bid.rename(columns={'bid_size_x':'current_vol','bid_size_y':'next_vol'}, inplace=True)
-            
-            # procedure
-            new_vols_bid['original_vol'] = new_vols_bid['current_vol'] - new_vols_bid['bid_added_vol']
-            
-            # scenario a: existing level w/o volume in next ob
-            new_vols_bid['new_vol'] = np.zeros(new_vols_bid.shape[0]) 
-            
-            # scenario b: added level with volume in next ob
-            indx_b = new_vols_bid[(new_vols_bid['original_vol']==0) & (new_vols_bid['next_vol']!=0)].index
-            new_vols_bid.loc[indx_b,'new_vol'] = new_vols_bid.loc[indx_b, 'current_vol'] + new_vols_bid.loc[indx_b,'next_vol'] 
-            
-            # scenario c: added level w/o volume in next ob
-            indx_c = new_vols_bid[(new_vols_bid['original_vol']==0) & (new_vols_bid['next_vol']==0)].index
-            new_vols_bid.loc[indx_c,'new_vol'] = new_vols_bid.loc[indx_c, 'bid_added_vol']
-                
-            # scenario d: existing level with volume in next ob
-            
-            indx_d = new_vols_bid[(new_vols_bid['original_vol']!=0) & (new_vols_bid['next_vol']!=0)].index
-            new_vols_bid.loc[indx_d,'new_vol'] = new_vols_bid.loc[indx_d, 'current_vol'] + (new_vols_bid.loc[indx_d, 'next_vol'] 
-                                                                                            - new_vols_bid.loc[indx_d, 'original_vol'])
-            
-            # identify filled orders
-            to_drop = new_vols_bid[new_vols_bid['new_vol'] == 0]
-            new_vols_bid.drop(to_drop.index, inplace=True)
-            new_vols_bid.reset_index(drop=True, inplace=True)
-            # output
-            df_bid = new_vols_bid[['bid_added_vol','new_vol', 'bid']]
-            df_bid.rename(columns={'new_vol':'bid_size'}, inplace=True)
-            
-            # Asks
-            
-            # data prep
-            new_vols_ask = pd.merge(bit_ask_new_tob, next_ob_bit_asks, on=['ask', 'ask_added_vol'], how='outer').fillna(0)
-            new_vols_ask = new_vols_ask.groupby(by='ask', as_index=False, sort=False).sum()
-            new_vols_ask.sort_values(by='ask', ignore_index=True, inplace=True)
-            new_vols_ask.rename(columns={'ask_size_x':'current_vol','ask_size_y':'next_vol'}, inplace=True)
-            
-            # procedure
-            new_vols_ask['original_vol'] = new_vols_ask['current_vol'] - new_vols_ask['ask_added_vol']
-            new_vols_ask.drop(new_vols_ask[new_vols_ask['ask']==0].index, inplace=True) # drop levels whose price is 0
-            new_vols_ask.reset_index(drop=True, inplace=True)
-            
-            # scenario a: existing level w/o volume in next ob
-            new_vols_ask['new_vol'] = np.zeros(new_vols_ask.shape[0]) 
-            
-            # scenario b: added level with volume in next ob
-            indx_b = new_vols_ask[(new_vols_ask['original_vol']==0) & (new_vols_ask['next_vol']!=0)].index
-            new_vols_ask.loc[indx_b,'new_vol'] = new_vols_ask.loc[indx_b, 'current_vol'] + new_vols_ask.loc[indx_b,'next_vol'] 
-            
-            # scenario c: added level w/o volume in next ob
-            indx_c = new_vols_ask[(new_vols_ask['original_vol']==0) & (new_vols_ask['next_vol']==0)].index
-            new_vols_ask.loc[indx_c,'new_vol'] = new_vols_ask.loc[indx_c, 'ask_added_vol']
-            
-            # scenario d: existing level with volume in next ob
-            indx_d = new_vols_ask[(new_vols_ask['original_vol']!=0) & (new_vols_ask['next_vol']!=0)].index
-            new_vols_ask.loc[indx_d,'new_vol'] = new_vols_ask.loc[indx_d, 'current_vol'] + (new_vols_ask.loc[indx_d, 'next_vol'] 
-                                                                                            - new_vols_ask.loc[indx_d, 'original_vol'])
-            to_drop = new_vols_ask[new_vols_ask['new_vol'] == 0]
-            new_vols_ask.drop(to_drop.index, inplace=True)
-            new_vols_ask.reset_index(drop=True, inplace=True)
-            
-            # output
-            df_ask = new_vols_ask[['ask','new_vol','ask_added_vol']]
-            df_ask.rename(columns={'new_vol':'ask_size'}, inplace=True)
-            df_out = pd.concat([df_bid, df_ask], axis=1)
-
-            # fill bid limit orders
-            bids_to_fill = new_vols_bid[(new_vols_bid['original_vol']!=0) & (new_vols_bid['next_vol']==0)][['bid_added_vol','bid']]
-            bids_to_fill_hist.append(bids_to_fill['bid_added_vol'].sum())
-            
-            for vol_to_fill in bids_to_fill['bid_added_vol'].values:
-                # Hedge transaction in origin market (Kraken)
-                next_ob_krak_asks['accum_size'] = next_ob_krak_asks['ask_size'].cumsum()
-                next_ob_krak_asks['remaining_vol'] = vol_to_fill - next_ob_krak_asks['accum_size']
-                to_drop = next_ob_krak_asks[next_ob_krak_asks['remaining_vol']>0]
-
-                next_ob_krak_asks.drop(to_drop.index, inplace=True)
-                next_ob_krak_asks.reset_index(drop=True, inplace=True)
-
-                new_vol = -next_ob_krak_asks.iloc[0,-1] # remaing volume on surviving level
-
-                next_ob_krak_asks.iloc[0,1] = new_vol
-                next_ob_krak_asks.drop(['accum_size','remaining_vol'], axis=1, inplace=True)
-                next_ob_krak_asks.reset_index(drop=True, inplace=True)
-
-
-
-            # fill ask limit orders
-            asks_to_fill = new_vols_ask[(new_vols_ask['original_vol']!=0) & (new_vols_ask['next_vol']==0)][['ask_added_vol','ask']]
-            asks_to_fill_hist.append(asks_to_fill['ask_added_vol'].sum())
-
-            for vol_to_fill in asks_to_fill['ask_added_vol'].values:
-                # Hedge transaction in origin market (Kraken)
-                next_ob_krak_bids['accum_size'] = next_ob_krak_bids['bid_size'].cumsum()
-                next_ob_krak_bids['remaining_vol'] = vol_to_fill - next_ob_krak_bids['accum_size']
-                to_drop = next_ob_krak_bids[next_ob_krak_bids['remaining_vol']>0]
-
-                next_ob_krak_bids.drop(to_drop.index, inplace = True)
-                next_ob_krak_bids.reset_index(drop = True, inplace = True)
-
-                new_vol = -next_ob_krak_bids.iloc[0, -1] # remaining volume on surviving level
-
-                next_ob_krak_bids.iloc[0, 1] = new_vol
-                next_ob_krak_bids.drop(['accum_size', 'remaining_vol'], axis = 1, inplace = True)
-                next_ob_krak_bids.reset_index(drop = True, inplace = True)
-
-            # re-assign variables for next iteration           
-            df_bit = df_out
-            bit_ask = df_bit[['ask', 'ask_size', 'ask_added_vol']]
-            bit_bid = df_bit[['bid_added_vol', 'bid_size', 'bid']]
-
-            df_krak = pd.concat([next_ob_krak_bids, next_ob_krak_asks], axis = 1)        
-            mid_krak = (df_krak['bid'][0] + df_krak['ask'][0]) / 2  
-        
-        self.token_exposure = np.array(token_hist_dest) + np.array(token_hist_origin) - 2 * self.initial_token
-        
-        results = {'fiat_bal_dest': self.fiat_bal_dest, 'token_bal_dest': self.token_bal_dest,
-                   'fiat_bal_origin': self.fiat_bal_origin, 'token_bal_origin': self.token_bal_origin,
-                   'ob_xemm': ob_xemm, 'fees_dest': fees_dest, 'fees_origin': fees_origin, 
-                   'fiat_hist_dest': fiat_hist_dest, 'fiat_hist_origin': fiat_hist_origin,
-                   'token_exposure':self.token_exposure}
-        
-        return results
 
-        
\ No newline at end of file
+def _venue_run(dest_venue: str, dest: dict, origins: dict, params: dict) -> tuple:
+    origin_fees = {venue: (spec['fee_taker'], spec['fee_maker']) for venue, spec in origins.items()}
+    snapshots = dt.iter_venues({venue: spec['columns'] for venue, spec in origins.items()}, dest['columns'])
+    xemm = XEMM(snapshots=snapshots, origin_fees=origin_fees, fee_taker_dest=dest['fee_taker'],
+                fee_maker_dest=dest['fee_maker'], **params)
+    return dest_venue, xemm.cross_exchange_market_making()
+
+
+def multi_venue_xemm(origins: dict, destinations: dict, max_workers: int = None, **params) -> dict:
+    """
+    Makes markets on every destination venue from several origin (hedge) venues. Each destination
+    runs its own XEMM in a separate process: levels are replicated from the best bid and ask among
+    the origins and every hedge goes to the origin with the best top net of fees.
+
+    Destinations share no state (each one hedges against its own view of the origin books), so the
+    run time grows with the number of destinations divided by the number of cores.
+
+    Parameters:
+    -----------
+        origins: venue names as keys and {'columns': orderbooks stored as columns (data.to_columns
+          or data.read_cacheOB), 'fee_taker': float, 'fee_maker': float} as values (dict)
+        destinations: same mapping for the venues where the levels are replicated (dict)
+        max_workers: number of processes (int) (default = number of cores)
+        params: any other XEMM constructor parameter (bp, prcnt, balances, ...)
+
+    Returns:
+    --------
+        Destination venue names as keys and the results of their cross_exchange_market_making as
+        values (dict).
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(destinations)) or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_venue_run, venue, dest, origins, params)
+                   for venue, dest in destinations.items()]
+        return dict(future.result() for future in futures)
+
+
+# orderbook columns memory-mapped once per sweep worker
+_SWEEP_DATA = {}
+
+
+def _sweep_init(file_name: str, file_dir: str, report_dir: str = None):
+    _SWEEP_DATA.update(dt.read_cacheOB(file_name, file_dir))
+    _SWEEP_DATA['report_dir'] = report_dir
+
+
+def _sweep_run(params: dict) -> dict:
+    # every run walks its own cursor over the shared read-only arrays, so no copies are needed
+    snapshots = dt.iter_columns(_SWEEP_DATA['kraken'], _SWEEP_DATA['bitfinex'])
+    results = XEMM(snapshots=snapshots, **params).cross_exchange_market_making()
+    report = {}
+    if _SWEEP_DATA['report_dir'] is not None:
+        # the sweep already uses every core, so each report is rendered in its worker
+        from visualizations import XemmVisualization
+        name = '_'.join(f'{param}={value}' for param, value in params.items()) or 'xemm'
+        report['report'] = XemmVisualization.report(
+            results, _SWEEP_DATA['kraken'], _SWEEP_DATA['bitfinex'],
+            os.path.join(_SWEEP_DATA['report_dir'], name + '.html'), max_workers=1, title=name)[0]
+    return {**params, **report,
+            'fiat_bal_dest': results['fiat_bal_dest'], 'token_bal_dest': results['token_bal_dest'],
+            'fiat_bal_origin': results['fiat_bal_origin'], 'token_bal_origin': results['token_bal_origin'],
+            'fees_dest': np.sum(results['fees_dest']), 'fees_origin': np.sum(results['fees_origin']),
+            'token_exposure': results['token_exposure'][-1],
+            'max_token_exposure': np.abs(results['token_exposure']).max(),
+            'max_drawdown': results['metrics']['max_drawdown'].max(initial=0.)}
+
+
+def parameter_sweep(file_name: str, grid: dict, file_dir: str = None, max_workers: int = None,
+                    report_dir: str = None) -> pd.DataFrame:
+    """
+    Runs the XEMM for every combination of a parameter grid in parallel over a process pool. The
+    orderbooks file is converted once into its columnar cache (data.cache_jsonOB), which every worker
+    memory-maps, so the data is shared through the page cache instead of being copied per run.
+
+    Parameters:
+    -----------
+        file_name: orderbooks file (str)
+        grid: XEMM constructor parameters as keys and the values to try as lists, e.g.
+          {'bp': [5, 10], 'prcnt': [.5, 1]} (dict)
+        file_dir: directory of the file (str) (default = current folder)
+        max_workers: number of processes (int) (default = number of cores)
+        report_dir: directory where an HTML report (visualizations.XemmVisualization.report) of every
+          combination is written (str) (default = None, no reports)
+
+    Returns:
+    --------
+        One row per combination with its parameters, final balances, total fees and token exposure
+        (final and maximum absolute), maximum drawdown of the mark-to-market P&L, and the path of its
+        report (pd.DataFrame).
+    """
+    dt.cache_jsonOB(file_name, file_dir)
+    if report_dir is not None:
+        os.makedirs(report_dir, exist_ok=True)
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(combinations) // (4*max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_sweep_init,
+                             initargs=(file_name, file_dir, report_dir)) as executor:
+        rows = list(executor.map(_sweep_run, combinations, chunksize=chunksize))
+
+    return pd.DataFrame(rows)
+
+
+def _quote_events(origin: dict, bp: float) -> int:
+    # origin levels within bp of the mid of their snapshot: every quote round draws one transaction
+    # time per level it replicates (XEMM._on_origin_update), so this bounds the draws of a run
+    bid, ask = dt.top_of_book(origin)
+    mid = np.repeat((bid + ask) / 2, np.diff(origin['offsets']))
+    return int((origin['bid'] > mid*(1 - bp / 10000)).sum() + (origin['ask'] < mid*(1 + bp / 10000)).sum())
+
+
+def _monte_carlo_run(run: int, seed: np.random.SeedSequence, params: dict) -> dict:
+    origin, dest = _SWEEP_DATA['kraken'], _SWEEP_DATA['bitfinex']
+    # the transaction times of the whole run are one draw sized to its quote events (bp defaults as
+    # in XEMM); the generator draws the same stream whatever the block size
+    xemm = XEMM(snapshots=dt.iter_columns(origin, dest), rng=np.random.default_rng(seed),
+                draw_block=max(1, _quote_events(origin, params.get('bp', 10))), **params)
+    results = xemm.cross_exchange_market_making()
+
+    fiat_dest, token_dest, fiat_origin, token_origin = xemm._initial_balances
+    bid, ask = dt.top_of_book(origin)
+    mark = (bid[-1] + ask[-1]) / 2
+    fiat_pnl = results['fiat_bal_dest'] + results['fiat_bal_origin'] - fiat_dest - fiat_origin
+    token_pnl = results['token_bal_dest'] + results['token_bal_origin'] - token_dest - token_origin
+    return {'run': run, 'pnl': fiat_pnl + token_pnl*mark, 'fiat_pnl': fiat_pnl, 'token_pnl': token_pnl,
+            'fees_dest': np.sum(results['fees_dest']), 'fees_origin': np.sum(results['fees_origin']),
+            'fills': int((~xemm.store.table('fills')['hedge']).sum()),
+            'max_token_exposure': np.abs(results['token_exposure']).max(),
+            'max_drawdown': results['metrics']['max_drawdown'].max(initial=0.)}
+
+
+def latency_monte_carlo(file_name: str, n_runs: int, seed: int = None, file_dir: str = None,
+                        max_workers: int = None, **params) -> pd.DataFrame:
+    """
+    Monte Carlo of the transaction times: runs the XEMM under n_runs independent latency scenarios in
+    parallel. Every run has its own np.random.Generator, spawned from one seed so the scenarios are
+    independent and reproducible, and draws the transaction times of the whole run at once. The data
+    is shared by the workers through the columnar cache, as in parameter_sweep.
+
+    Parameters:
+    -----------
+        file_name: orderbooks file (str)
+        n_runs: number of latency scenarios (int)
+        seed: seed of the scenarios (int) (default = None, fresh entropy)
+        file_dir: directory of the file (str) (default = current folder)
+        max_workers: number of processes (int) (default = number of cores)
+        params: any other XEMM constructor parameter (bp, prcnt, latency_limit, ...)
+
+    Returns:
+    --------
+        One row per run with its P&L (fiat plus token change marked at the last origin mid-price),
+        fiat and token changes, total fees, number of XEMM fills on the destination and maximum
+        absolute token exposure and maximum drawdown of the running P&L; e.g.
+        .describe(percentiles=[.05, .5, .95]) gives the P&L distribution (pd.DataFrame).
+    """
+    dt.cache_jsonOB(file_name, file_dir)
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, n_runs // (4*max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_sweep_init,
+                             initargs=(file_name, file_dir)) as executor:
+        rows = list(executor.map(_monte_carlo_run, range(n_runs), seeds, itertools.repeat(params),
+                                 chunksize=chunksize))
+
+    return pd.DataFrame(rows)
+
+
+def _shard_checkpoint(checkpoint_dir: str, run: str, i: int, file_name: str) -> str:
+    # chained and parallel boundary checkpoints never share a name
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(checkpoint_dir, f'{run}_{i:03d}_{stem}.ckpt')
+
+
+def _shard_store(store: dt.ResultsStore, path: str) -> dt.ResultsStore:
+    # results store with the settings of the given one (the defaults when None) on its own directory
+    if store is None:
+        return dt.ResultsStore(path=path)
+    return dt.ResultsStore(store.depth, store.sample_every, path, store.chunk_size)
+
+
+def _shard_params(params: dict, checkpoints: list) -> list:
+    """
+    XEMM parameters of each parallel shard: its own results store, in a shard_<i> subdirectory of the
+    given store's (or next to its boundary checkpoint, which needs one streaming to disk), and its
+    own random generator, spawned from a SeedSequence seeded by the given one.
+    """
+    store, rng = params.get('store'), params.get('rng')
+    if rng is not None:
+        seeds = np.random.SeedSequence(rng.integers(2**63, size=4)).spawn(len(checkpoints))
+    shards = []
+    for i, checkpoint in enumerate(checkpoints):
+        shard = dict(params)
+        if store is not None and store.path is not None:
+            shard['store'] = _shard_store(store, os.path.join(store.path, f'shard_{i:03d}'))
+        elif checkpoint is not None:
+            shard['store'] = _shard_store(store, os.path.splitext(checkpoint)[0] + '_results')
+        elif store is not None:
+            shard['store'] = _shard_store(store, None)
+        if rng is not None:
+            shard['rng'] = np.random.Generator(type(rng.bit_generator)(seeds[i]))
+        shards.append(shard)
+    return shards
+
+
+def _shard_run(file_name: str, file_dir: str, checkpoint: str, params: dict) -> tuple:
+    # one independent shard run from the initial state; its boundary checkpoint is written at the end
+    xemm = XEMM(**params)
+    for update in dt.iter_cacheOB(file_name, file_dir):
+        xemm.step(*update)
+    if checkpoint is not None:
+        xemm.checkpoint(checkpoint, run='shard')
+    return xemm.results(), xemm._initial_balances
+
+
+def _stitch_independent_shards(shards: list) -> dict:
+    """
+    Results of consecutive shards, each run on its own from the same initial balances, laid end to
+    end: the balance changes of each shard are carried over to the following ones (P&L marked at each
+    tick's mid, drawdowns taken over the whole run, the destination inventory added up while its
+    average cost stays the shard's own), and the tables and orderbooks are concatenated.
+    No XEMM levels or orders in flight cross a boundary, so this approximates the chained run; it is
+    not the same run.
+    """
+    columns = ('fiat_bal_dest', 'token_bal_dest', 'fiat_bal_origin', 'token_bal_origin')
+    offset = np.zeros(4)
+    snapshots, metrics, books, fees_dest, fees_origin = [], [], {}, [], []
+    fees = dest = 0.
+    for results, initial in shards:
+        table, running = results['snapshots'].copy(), results['metrics'].copy()
+        for col, value in zip(columns, offset):
+            table[col] += value
+        fiat, token = offset[0] + offset[2], offset[1] + offset[3]
+        running['pnl'] += fiat + token*running['mid']
+        running['inventory'] += token
+        running['dest_inventory'] += dest
+        running['fees'] += fees
+        snapshots.append(table)
+        metrics.append(running)
+        books.update(results['ob_xemm'])
+        fees_dest.append(results['fees_dest'])
+        fees_origin.append(results['fees_origin'])
+        offset += np.array([results[col] for col in columns]) - initial
+        fees += np.sum(results['fees_dest']) + np.sum(results['fees_origin'])
+        dest = running['dest_inventory'][-1] if len(running) else dest
+
+    initial = np.asarray(shards[0][1])
+    snapshots, metrics = np.concatenate(snapshots), np.concatenate(metrics)
+    peak = np.maximum.accumulate(metrics['pnl'])
+    metrics['drawdown'] = peak - metrics['pnl']
+    metrics['max_drawdown'] = np.maximum.accumulate(metrics['drawdown'])
+    hist = {col: np.concatenate([[value], snapshots[col]]) for col, value in zip(columns, initial)}
+    final = initial + offset
+    return {'fiat_bal_dest': final[0], 'token_bal_dest': final[1], 'fiat_bal_origin': final[2],
+            'token_bal_origin': final[3], 'ob_xemm': books, 'snapshots': snapshots,
+            'fees_dest': np.concatenate(fees_dest), 'fees_origin': np.concatenate(fees_origin),
+            'fiat_hist_dest': hist['fiat_bal_dest'], 'fiat_hist_origin': hist['fiat_bal_origin'],
+            'token_exposure': hist['token_bal_dest'] + hist['token_bal_origin'] - 2*initial[1],
+            'metrics': metrics}
+
+
+def sharded_xemm(file_names: list, file_dir: str = None, checkpoint_dir: str = None, chain: bool = False,
+                 max_workers: int = None, **params) -> dict:
+    """
+    Runs the XEMM over consecutive orderbook files (e.g. one per day) as shards with a boundary
+    checkpoint (XEMM.checkpoint) written at the end of each one.
+
+    Chained (chain=True), every shard continues from the state the previous one left: the run is the
+    same as a single run over the aligned snapshots of the files one after the other (each file is
+    aligned on its own), and it resumes after the last shard whose boundary checkpoint is already in
+    checkpoint_dir.
+
+    Otherwise the shards are independent: they run in parallel over a process pool, each from the
+    initial state (no XEMM levels, orders in flight or balance history carried over a boundary),
+    and their results are laid end to end. This is an approximation of the multi-day run, not the
+    run itself: whatever the previous shard left resting or in flight is lost at every boundary, so
+    the balances differ from the chained ones, and fill_ratio and fee_drag of the metrics are those
+    of each shard.
+
+    Parameters:
+    -----------
+        file_names: orderbooks files in time order (list)
+        file_dir: directory of the files (str) (default = current folder)
+        checkpoint_dir: directory of the boundary checkpoints (chain_<i>_<file>.ckpt when chained,
+          shard_<i>_<file>.ckpt otherwise) and, unless a store is given, of the results stores they
+          need (str) (default = None, not kept when running in parallel, no resuming when chained)
+        chain: run the shards one after the other from the previous shard's state (bool)
+          (default = False, independent shards in parallel)
+        max_workers: number of processes when running in parallel (int) (default = number of cores)
+        params: any other XEMM constructor parameter; a results store or random generator given here
+          is shared by the chained shards, while each parallel one gets a store with the same settings
+          in a shard_<i> subdirectory of its path and a generator spawned from a SeedSequence seeded
+          by the given one (independent transaction times, reproducible for a seeded generator)
+
+    Returns:
+    --------
+        Same dictionary as cross_exchange_market_making over all the shards (dict).
+    """
+    run = 'chain' if chain else 'shard'
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoints = [None if checkpoint_dir is None else _shard_checkpoint(checkpoint_dir, run, i, file_name)
+                   for i, file_name in enumerate(file_names)]
+
+    if chain:
+        if checkpoint_dir is not None and params.get('store') is None:
+            params = {**params, 'store': _shard_store(None, os.path.join(checkpoint_dir, 'chain_results'))}
+        xemm = XEMM(**params)
+        done = 0
+        while done < len(file_names) and checkpoints[done] is not None and os.path.exists(checkpoints[done]):
+            done += 1
+        if done:
+            xemm.restore(checkpoints[done - 1], run)
+        for file_name, checkpoint in zip(file_names[done:], checkpoints[done:]):
+            for update in dt.iter_cacheOB(file_name, file_dir):
+                xemm.step(*update)
+            if checkpoint is not None:
+                xemm.checkpoint(checkpoint, run)
+        return xemm.results()
+
+    for file_name in file_names:
+        dt.cache_jsonOB(file_name, file_dir)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(file_names)) or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_shard_run, file_name, file_dir, checkpoint, shard)
+                   for file_name, checkpoint, shard in zip(file_names, checkpoints,
+                                                           _shard_params(params, checkpoints))]
+        shards = [future.result() for future in futures]
+    return _stitch_independent_shards(shards)
@@ -16,11 +16,13 @@ from visualizations import XemmVisualization
 import warnings
 warnings.filterwarnings('ignore')
 
-ob_krak, ob_bit = dt.read_jsonOB(file_name = 'orderbooks_05jul21.json')
-obt = XEMM(ob_krak=ob_krak, ob_bit=ob_bit)
+# the JSON file is parsed once into a columnar cache next to it, later runs load the arrays
+cache = dt.read_cacheOB(file_name = 'orderbooks_05jul21.json')
+ob_krak, ob_bit = cache['kraken'], cache['bitfinex']
+obt = XEMM(snapshots=dt.iter_columns(ob_krak, ob_bit))
 ob_xemm = obt.cross_exchange_market_making()
 plots = XemmVisualization()
-plots.plot_mid(xemm = ob_xemm['ob_xemm'], origin = ob_krak, destination = ob_bit,
+plots.plot_mid(xemm = ob_xemm['snapshots'], origin = ob_krak, destination = ob_bit,
  fiat_hist_origin=ob_xemm['fiat_hist_origin'], fiat_hist_dest=ob_xemm['fiat_hist_dest'])
 plots.cash_balances(fiat_bal_origin = ob_xemm['fiat_bal_origin'], fiat_bal_dest = ob_xemm['fiat_bal_dest'])
 plots.tokens_balances(token_bal_origin = ob_xemm['token_bal_origin'], token_bal_dest = ob_xemm['token_bal_dest'])
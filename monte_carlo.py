@@ -0,0 +1,42 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: monte_carlo.py: command line Monte Carlo of the XEMM transaction times                       -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+Example:
+    python monte_carlo.py orderbooks_05jul21.json --runs 200 --seed 7 --bp 10 --output runs.csv
+"""
+
+import argparse
+from functions import latency_monte_carlo
+from parameter_sweep import PARAMETERS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the XEMM under independent latency scenarios in parallel.')
+    parser.add_argument('file_name', help="orderbooks file (must include '.json')")
+    parser.add_argument('--runs', type=int, default=100, help='number of latency scenarios')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the scenarios (default: fresh entropy)')
+    parser.add_argument('--file_dir', default=None, help='directory of the file (default: current folder)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--output', default=None, help='csv file for the runs table')
+    for name in PARAMETERS:
+        parser.add_argument(f'--{name}', type=float, help='XEMM parameter')
+    parser.add_argument('--fill_model', choices=['top', 'queue'], default=None, help='maker fill model')
+    args = parser.parse_args(argv)
+
+    params = {name: getattr(args, name) for name in PARAMETERS + ('fill_model',) if getattr(args, name) is not None}
+    runs = latency_monte_carlo(args.file_name, args.runs, seed=args.seed, file_dir=args.file_dir,
+                               max_workers=args.workers, **params)
+
+    print(runs.drop(columns='run').describe(percentiles=[.01, .05, .25, .5, .75, .95, .99]).T.to_string())
+    if args.output:
+        runs.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: parameter_sweep.py: command line parameter sweep of the XEMM                                -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+Example:
+    python parameter_sweep.py orderbooks_05jul21.json --bp 5 10 20 --prcnt .5 1 --output sweep.csv
+    python parameter_sweep.py orderbooks_05jul21.json --bp 5 10 --reports reports
+    python parameter_sweep.py orderbooks_05jul21.json --bp 5 10 --fill_model top queue
+"""
+
+import argparse
+from functions import parameter_sweep
+
+# XEMM constructor parameters that can be swept
+PARAMETERS = ('bp', 'prcnt', 'rebal_threshold', 'fee_taker_dest', 'fee_maker_dest',
+              'fee_taker_origin', 'fee_maker_origin', 'latency_limit')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the XEMM over a grid of parameters in parallel.')
+    parser.add_argument('file_name', help="orderbooks file (must include '.json')")
+    parser.add_argument('--file_dir', default=None, help='directory of the file (default: current folder)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--output', default=None, help='csv file for the results table (default: print it)')
+    parser.add_argument('--reports', default=None, help='directory for an HTML report of every run (default: none)')
+    for name in PARAMETERS:
+        parser.add_argument(f'--{name}', type=float, nargs='+', help='values to try')
+    parser.add_argument('--fill_model', nargs='+', choices=['top', 'queue'], help='maker fill models to try')
+    args = parser.parse_args(argv)
+
+    grid = {name: getattr(args, name) for name in PARAMETERS + ('fill_model',) if getattr(args, name) is not None}
+    results = parameter_sweep(args.file_name, grid, file_dir=args.file_dir, max_workers=args.workers,
+                              report_dir=args.reports)
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+    else:
+        print(results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
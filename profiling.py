@@ -0,0 +1,132 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: profiling.py: per-phase timing instrumentation of the XEMM                                  -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+Example:
+    profiler = Profiler()
+    XEMM(ob_krak=ob_krak, ob_bit=ob_bit, profiler=profiler).cross_exchange_market_making()
+    print(profiler.summary())
+    profiler.to_chrome_trace('xemm_trace.json')
+"""
+
+import sys
+import json
+import pandas as pd
+from time import perf_counter
+
+
+class Profiler:
+    """
+    Records the wall time, calls and allocated memory blocks of the XEMM phases for every snapshot.
+    XEMM wraps its phases with the profiler only when one is given, so an unprofiled run executes
+    the plain methods.
+
+    Phases:
+    -------
+        step: whole XEMM.step call (its own time is the event queue and snapshot handling).
+        replication: origin update, replicating levels and sending the orders.
+        order_arrival: taker fills and maker insertions on the destination book.
+        hedge: hedges of the taker fills on the origin book.
+        maker_fills: destination update, filling the XEMM levels traded through.
+        reconcile: merge of the XEMM levels with the next destination snapshot.
+
+    Methods:
+    --------
+        --wrap: instruments a function as a phase.
+        --snapshot: sets the snapshot the following records belong to.
+        --records: every phase call as a DataFrame.
+        --summary: calls, time and allocations per phase.
+        --per_snapshot: own time of every phase on each snapshot.
+        --to_chrome_trace: writes a Chrome trace (chrome://tracing, Perfetto) file.
+        --to_speedscope: writes a speedscope (https://www.speedscope.app) file.
+    """
+    def __init__(self):
+        self._records = []  # (snapshot, phase, start, seconds, own seconds, allocated blocks)
+        self._snapshot = None
+        self._children = [0.]  # time spent in nested phases, one entry per open phase
+
+    def wrap(self, phase: str, func):
+        records, children = self._records, self._children
+
+        def timed(*args, **kwargs):
+            children.append(0.)
+            blocks = sys.getallocatedblocks()
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+                nested = children.pop()
+                children[-1] += seconds
+                records.append((self._snapshot, phase, start, seconds, seconds - nested,
+                                sys.getallocatedblocks() - blocks))
+        return timed
+
+    def snapshot(self, label):
+        self._snapshot = label
+
+    def records(self) -> pd.DataFrame:
+        return pd.DataFrame(self._records, columns=['snapshot', 'phase', 'start', 'seconds',
+                                                    'own_seconds', 'allocated_blocks'])
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Calls, total/own/mean/max seconds, share of the profiled time and net allocated memory
+        blocks of each phase, sorted by own time.
+        """
+        records = self.records()
+        summary = records.groupby('phase').agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                               own_seconds=('own_seconds', 'sum'),
+                                               mean_seconds=('seconds', 'mean'), max_seconds=('seconds', 'max'),
+                                               allocated_blocks=('allocated_blocks', 'sum'))
+        summary['share'] = summary['own_seconds'] / summary['own_seconds'].sum()
+        return summary.sort_values('own_seconds', ascending=False)
+
+    def per_snapshot(self) -> pd.DataFrame:
+        """
+        Own seconds of every phase (columns) on each snapshot (rows).
+        """
+        return self.records().pivot_table(index='snapshot', columns='phase', values='own_seconds',
+                                          aggfunc='sum', fill_value=0., sort=False)
+
+    def _events(self) -> list:
+        # open/close events ordered so that nested phases close before the phases containing them
+        events = []
+        for snapshot, phase, start, seconds, _, _ in self._records:
+            events.append((start, 1, -seconds, 'O', phase, snapshot))
+            events.append((start + seconds, 0, -start, 'C', phase, snapshot))
+        return sorted(events, key=lambda event: event[:3])
+
+    def to_chrome_trace(self, file_path: str):
+        """
+        Writes the phase calls as complete events in the Chrome trace format.
+        """
+        origin = min((record[2] for record in self._records), default=0.)
+        trace = [{'name': phase, 'cat': 'xemm', 'ph': 'X', 'pid': 1, 'tid': 1,
+                  'ts': (start - origin)*1e6, 'dur': seconds*1e6,
+                  'args': {'snapshot': str(snapshot), 'allocated_blocks': blocks}}
+                 for snapshot, phase, start, seconds, _, blocks in self._records]
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def to_speedscope(self, file_path: str):
+        """
+        Writes the phase calls as an evented profile in the speedscope file format.
+        """
+        phases = sorted({phase for _, phase, *_ in self._records})
+        frame = {phase: i for i, phase in enumerate(phases)}
+        events = self._events()
+        origin = events[0][0] if events else 0.
+        profile = {'type': 'evented', 'name': 'XEMM', 'unit': 'seconds', 'startValue': 0.,
+                   'endValue': events[-1][0] - origin if events else 0.,
+                   'events': [{'type': kind, 'frame': frame[phase], 'at': at - origin}
+                              for at, _, _, kind, phase, _ in events]}
+        with open(file_path, 'w') as f:
+            json.dump({'$schema': 'https://www.speedscope.app/file-format-schema.json',
+                       'shared': {'frames': [{'name': phase} for phase in phases]},
+                       'profiles': [profile], 'exporter': 'XEMM profiling'}, f)
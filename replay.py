@@ -0,0 +1,254 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: replay.py: asyncio replay of recorded orderbooks as live feeds driving the XEMM              -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+The origin ('kraken') and destination ('bitfinex') books of a capture file are published by two local
+exchange stand-ins as concurrent asyncio feeds, at their recorded pace or faster, and a client drives
+XEMM.step from them the way it would run against live websockets: every origin update is a tick,
+stepped with the destination updates already received since the previous tick (the destination feed
+is drained without waiting). With wait_dest the client instead waits until the destination feed has
+moved past the tick's timestamp, which no live client can do, so the results are those of the batch
+run whatever the pace and backpressure (equality checks). Quotes are sent to the destination and
+hedges to the origin, which acknowledge them after a simulated latency. No network access is needed.
+
+Measured per tick: time the update waited in the feed, time waited for the destination feed (wait_dest
+only), step time and tick-to-quote latency (from the update being published to its quotes being sent,
+without the wait for the destination feed); per feed: time the publisher was blocked on a full feed
+(backpressure), deepest queue and lateness against the replay schedule; per exchange: order
+acknowledgement round trips.
+
+Example:
+    python replay.py orderbooks_05jul21.json --speed 20 --ack_latency 5 --output replay.csv
+    python replay.py orderbooks_05jul21.json --speed 0 --queue_size 8 --wait_dest
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import data as dt
+from functions import XEMM
+from parameter_sweep import PARAMETERS
+
+
+class LocalExchange:
+    """
+    Local stand-in for an exchange: publishes the recorded snapshots of one venue on a bounded feed
+    and acknowledges the orders sent to it after a simulated latency.
+
+    Parameters:
+    -----------
+        name: venue name (str)
+        columns: orderbooks of the venue stored as columns (data.to_columns or data.read_cacheOB) (dict)
+        queue_size: updates the feed holds before the publisher has to wait for the client (int)
+          (default = 64)
+        ack_latency: seconds before an order is acknowledged (float) (default = 0.005)
+
+    Methods:
+    --------
+        --publish: replays the snapshots on the feed and ends it with None (coroutine).
+        --submit: sends an order and waits for its acknowledgement (coroutine).
+    """
+    def __init__(self, name: str, columns: dict, queue_size: int = 64, ack_latency: float = .005):
+        self.name = name
+        self.columns = columns
+        self.ack_latency = ack_latency
+        self.feed = asyncio.Queue(maxsize=queue_size)
+        self.blocked = 0.  # seconds the publisher waited on a full feed
+        self.max_depth = 0
+        self.max_lag = 0.  # seconds behind the replay schedule
+        self.acks = []  # round trip of every order
+
+    async def publish(self, start: float, origin: int, speed: float):
+        """
+        Puts (timestamp, nanosecond timestamp, snapshot, publish time) on the feed at start + (timestamp - origin) / speed
+        (perf_counter seconds, nanosecond timestamps); speed 0 publishes as fast as the client reads.
+        """
+        columns = self.columns
+        for i, (key, timestamp) in enumerate(zip(columns['key'], columns['timestamp'])):
+            if speed:
+                due = start + (timestamp - origin)/1e9/speed
+                delay = due - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+
+            message = (str(key), timestamp, dt.snapshot_at(columns, i), perf_counter())
+            if self.feed.full():
+                waiting = perf_counter()
+                await self.feed.put(message)
+                self.blocked += perf_counter() - waiting
+            else:
+                self.feed.put_nowait(message)
+            self.max_depth = max(self.max_depth, self.feed.qsize())
+        await self.feed.put(None)
+
+    async def submit(self, order: tuple):
+        sent = perf_counter()
+        await asyncio.sleep(self.ack_latency)
+        self.acks.append(perf_counter() - sent)
+
+
+async def run_client(xemm: XEMM, origin: LocalExchange, dest: LocalExchange, speed: float = 1.,
+                     wait_dest: bool = False) -> pd.DataFrame:
+    """
+    Replays both exchanges concurrently and drives the XEMM from their feeds: each origin update is
+    stepped with every destination book received since the previous tick up to its timestamp
+    (origin updates before the first destination book are skipped); its quotes go to the destination
+    and its hedges to the origin without waiting for their acknowledgements.
+
+    Parameters:
+    -----------
+        wait_dest: each origin update waits for a destination book later than it (or the end of the
+          destination feed), so none at or before its timestamp is still in flight and the ticks are
+          paired as data.iter_columns pairs them (bool) (default = False, only the destination books
+          already on the feed)
+
+    Returns:
+    --------
+        One row per tick with the origin and latest destination timestamps, the seconds the update
+        waited in the feed, the seconds waited for the destination feed, the step time, the
+        tick-to-quote latency without the wait for the destination feed, the origin feed depth when
+        it was read and the quotes and hedges sent (pd.DataFrame).
+    """
+    start = perf_counter()
+    first = min(origin.columns['timestamp'][0], dest.columns['timestamp'][0])
+    publishers = [asyncio.create_task(exchange.publish(start, first, speed)) for exchange in (origin, dest)]
+    orders = set()
+
+    def send(exchange: LocalExchange, order: tuple):
+        task = asyncio.create_task(exchange.submit(order))
+        orders.add(task)
+        task.add_done_callback(orders.discard)
+
+    async def follow_origin() -> list:
+        rows = []
+        updates = []  # destination books since the previous tick
+        latest = None
+        ahead = None  # first destination book after the current origin update
+        dest_open = True
+        while (message := await origin.feed.get()) is not None:
+            origin_ts, timestamp, snapshot, published = message
+            received = perf_counter()
+            while dest_open and (ahead is None or ahead[1] <= timestamp):
+                if ahead is not None:
+                    updates.append(ahead)
+                    ahead = None
+                if not wait_dest and dest.feed.empty():
+                    break
+                if (ahead := await dest.feed.get()) is None:
+                    dest_open = False
+            dest_wait = perf_counter() - received if wait_dest else 0.
+            if not updates and latest is None:
+                continue
+            if latest is None:
+                # the first tick only carries the book it is paired with
+                updates = updates[-1:]
+            if updates:
+                latest = updates[-1]
+            tick = xemm.step(origin_ts, snapshot, [update[0] for update in updates],
+                             [update[2] for update in updates])
+            updates = []
+            for quote in tick['quotes']:
+                send(dest, quote)
+            for hedge in tick['hedges']:
+                send(origin, hedge)
+            rows.append((origin_ts, latest[0], received - published, dest_wait, tick['latency'],
+                         perf_counter() - published - dest_wait, origin.feed.qsize(), len(tick['quotes']),
+                         len(tick['hedges'])))
+            # let the feeds and acknowledgements run between ticks
+            await asyncio.sleep(0)
+        # drain the destination feed so its publisher can finish
+        while dest_open and await dest.feed.get() is not None:
+            pass
+        return rows
+
+    rows = await follow_origin()
+    await asyncio.gather(*publishers, *orders)
+    return pd.DataFrame(rows, columns=['timestamp', 'dest_timestamp', 'queue_wait', 'dest_wait', 'step_seconds',
+                                       'tick_to_quote', 'feed_depth', 'quotes', 'hedges'])
+
+
+def replay_summary(ticks: pd.DataFrame, seconds: float, origin: LocalExchange, dest: LocalExchange) -> dict:
+    """
+    Throughput, tick-to-quote latency and feed wait percentiles, backpressure of both feeds and
+    acknowledgement round trips of a replay.
+    """
+    summary = {'ticks': len(ticks), 'seconds': seconds, 'ticks_per_sec': len(ticks) / seconds if seconds else None,
+               'step_mean': ticks['step_seconds'].mean()}
+    for q in (.5, .99):
+        summary[f'tick_to_quote_p{q*100:g}'] = ticks['tick_to_quote'].quantile(q)
+        summary[f'queue_wait_p{q*100:g}'] = ticks['queue_wait'].quantile(q)
+        summary[f'dest_wait_p{q*100:g}'] = ticks['dest_wait'].quantile(q)
+    summary['tick_to_quote_max'] = ticks['tick_to_quote'].max()
+    for exchange in (origin, dest):
+        summary[f'{exchange.name}_blocked_seconds'] = exchange.blocked
+        summary[f'{exchange.name}_max_depth'] = exchange.max_depth
+        summary[f'{exchange.name}_max_lag'] = exchange.max_lag
+        summary[f'{exchange.name}_orders'] = len(exchange.acks)
+        summary[f'{exchange.name}_ack_p99'] = np.quantile(exchange.acks, .99) if exchange.acks else None
+    return summary
+
+
+def replay(file_name: str, file_dir: str = None, speed: float = 1., queue_size: int = 64,
+           ack_latency: float = .005, wait_dest: bool = False, **params) -> tuple:
+    """
+    Replays a capture file through the local exchanges and an XEMM client (see run_client).
+
+    Parameters:
+    -----------
+        file_name: orderbooks file (str)
+        file_dir: directory of the file (str) (default = current folder)
+        speed: replay speed over the recorded pace, 0 for as fast as the client reads (float) (default = 1)
+        queue_size: updates each feed holds before its publisher waits (int) (default = 64)
+        ack_latency: seconds both exchanges take to acknowledge an order (float) (default = 0.005)
+        wait_dest: pair every tick with the destination books up to its timestamp, as the batch run
+          does, waiting for them (see run_client) (bool) (default = False)
+        params: any other XEMM constructor parameter (bp, prcnt, balances, ...)
+
+    Returns:
+    --------
+        The XEMM results, the ticks table (run_client) and the summary (replay_summary) (tuple).
+    """
+    cache = dt.read_cacheOB(file_name, file_dir)
+    origin = LocalExchange('kraken', cache['kraken'], queue_size, ack_latency)
+    dest = LocalExchange('bitfinex', cache['bitfinex'], queue_size, ack_latency)
+    xemm = XEMM(**params)
+    start = perf_counter()
+    ticks = asyncio.run(run_client(xemm, origin, dest, speed, wait_dest))
+    summary = replay_summary(ticks, perf_counter() - start, origin, dest)
+    return xemm.results(), ticks, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replays a capture file as live feeds driving the XEMM.')
+    parser.add_argument('file_name', help="orderbooks file (must include '.json')")
+    parser.add_argument('--file_dir', default=None, help='directory of the file (default: current folder)')
+    parser.add_argument('--speed', type=float, default=1., help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--queue_size', type=int, default=64, help='updates each feed holds')
+    parser.add_argument('--ack_latency', type=float, default=5., help='order acknowledgement latency (ms)')
+    parser.add_argument('--wait_dest', action='store_true',
+                        help='wait for the destination feed to pass every tick (batch pairing)')
+    parser.add_argument('--output', default=None, help='csv file for the ticks table')
+    for name in PARAMETERS:
+        parser.add_argument(f'--{name}', type=float, help='XEMM parameter')
+    args = parser.parse_args(argv)
+
+    params = {name: getattr(args, name) for name in PARAMETERS if getattr(args, name) is not None}
+    _, ticks, summary = replay(args.file_name, args.file_dir, args.speed, args.queue_size,
+                               args.ack_latency / 1000, args.wait_dest, **params)
+    print(pd.Series(summary).to_string())
+    if args.output:
+        ticks.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
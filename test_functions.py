@@ -0,0 +1,81 @@
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Python implementation of cross exchange market-making (XEMM)                               -- #
+# -- script: test_functions.py: checks of the XEMM engine                                                -- #
+# -- author: MoyMFO, AndresLaresBarragan, Miriam1999                                                     -- #
+# -- license: GPL-3.0 license                                                                            -- #
+# -- repository: https://github.com/AndresLaresBarragan/MyST_XEMM                                        -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+
+Run with: python -m pytest test_functions.py
+"""
+
+import numpy as np
+import data as dt
+from functions import XEMM, OrderBook, BookSide
+
+
+def _dest_update(fill_model: str, next_bid: list, next_bid_size: list) -> XEMM:
+    # XEMM volume (1) resting behind 5 of exchange volume on the 99 bid, then a destination update
+    xemm = XEMM(fill_model=fill_model)
+    xemm._origins = {'origin': OrderBook.from_snapshot(dt.Snapshot(np.array([100.]), np.array([5.]),
+                                                                   np.array([101.]), np.array([5.])))}
+    xemm._bit = OrderBook(BookSide([100., 99.], [4., 6.], 'bid', added=[0., 1.]), BookSide([102.], [3.], 'ask'))
+    xemm._tick = {'fills': [], 'quotes': [], 'hedges': []}
+    xemm._on_dest_update(0, ('update', dt.Snapshot(np.array(next_bid), np.array(next_bid_size),
+                                                   np.array([102.]), np.array([3.]))))
+    return xemm
+
+
+def test_queue_keeps_volume_of_removed_level():
+    # the exchange removes the 99 level without trading through it: the XEMM volume keeps resting
+    xemm = _dest_update('queue', [101., 100.], [2., 4.])
+    np.testing.assert_array_equal(xemm._bit.bid.price, [101., 100., 99.])
+    np.testing.assert_array_equal(xemm._bit.bid.added, [0., 0., 1.])
+    assert xemm._tick['fills'] == []
+
+
+def test_queue_fills_level_traded_through():
+    # the next top of book is below 99: the whole queue was traded, the XEMM volume is filled
+    xemm = _dest_update('queue', [98.], [2.])
+    assert [(price, size) for _, price, size, _ in xemm._tick['fills']] == [(99., 1.)]
+    assert xemm._bit.bid.added.sum() == 0
+
+
+def test_queue_drains_volume_ahead_first():
+    # 4.5 of the 5 ahead leave the level: nothing is filled and 0.5 stays ahead of the XEMM volume
+    xemm = _dest_update('queue', [100., 99.], [4., 0.5])
+    assert xemm._tick['fills'] == []
+    np.testing.assert_array_equal(xemm._bit.bid.added, [0., 1.])
+    np.testing.assert_array_equal(xemm._queues[True][1], [0.5])
+
+
+def test_splice_sets_inserts_and_removes_levels():
+    # one level changed, one removed and two inserted (one past the deepest) in place
+    side = BookSide([105., 104., 103., 102.], [1., 2., 3., 4.], 'bid', added=[0., 1., 0., 0.])
+    side.splice(side.to_key(np.array([104.5, 104., 103., 101.])), np.array([5., 6., np.nan, 7.]),
+                np.array([0., 1., 0., 0.]))
+    np.testing.assert_array_equal(side.price, [105., 104.5, 104., 102., 101.])
+    np.testing.assert_array_equal(side.size, [1., 5., 6., 4., 7.])
+    np.testing.assert_array_equal(side.added, [0., 0., 1., 0., 0.])
+
+
+def test_delta_update_matches_snapshot_update():
+    # the same destination updates given as level changes or as whole books, with XEMM volume resting
+    ask, ask_size = np.array([102.]), np.array([3.])
+    updates = {False: [dt.Snapshot(np.array([100., 99., 98.]), np.array([4., 6., 2.]), ask, ask_size),
+                       dt.Snapshot(np.array([100., 98., 97.]), np.array([4., 1., 8.]), ask, ask_size)],
+               True: [dt.Deltas(np.array([100., 99., 98., 102.]), np.array([4., 6., 2., 3.]),
+                                np.array([True, True, True, False])),
+                      dt.Deltas(np.array([99., 98., 97.]), np.array([np.nan, 1., 8.]), np.array([True]*3))]}
+    books = []
+    for deltas in (False, True):
+        xemm = XEMM()
+        xemm._origins = {'origin': OrderBook.from_snapshot(dt.Snapshot(np.array([100.]), np.array([5.]),
+                                                                       np.array([101.]), np.array([5.])))}
+        xemm._tick = {'fills': [], 'quotes': [], 'hedges': []}
+        xemm._on_dest_update(0, ('first', updates[deltas][0]))
+        xemm._bit.bid.insert(97.5, 1.)
+        xemm._on_dest_update(1, ('next', updates[deltas][1]))
+        books.append(xemm._bit.to_frame())
+    assert books[0].equals(books[1])
@@ -8,120 +8,211 @@
 # -- --------------------------------------------------------------------------------------------------- -- #
 """
 
+import os
+import html
 import plotly.graph_objects as go
-import pandas as pd
+import numpy as np
+import data as dt
+from concurrent.futures import ProcessPoolExecutor
 from plotly.subplots import make_subplots
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: positions of the n_out points that keep the visual
+    shape of the series (the first and last points are always kept).
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    # n_out - 2 buckets between the first and last points, and the average point of each one
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:edges[-1]], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:edges[-1]], edges[:-1]) / counts, y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for k in range(n_out - 2):
+        # point of the bucket with the largest triangle with the last kept point and the next average
+        lo, hi = edges[k], edges[k+1]
+        area = np.abs((x[a] - avg_x[k+1])*(y[lo:hi] - y[a]) - (x[a] - x[lo:hi])*(avg_y[k+1] - y[a]))
+        a = lo + area.argmax()
+        out[k+1] = a
+    return out
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Min/max downsampling: positions of the first and last points and of the lowest and highest point
+    of (n_out - 2) / 2 equal buckets.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    n_buckets = max((n_out - 2) // 2, 1)
+    width = -(-n // n_buckets)
+    pad = n_buckets*width - n
+    start = np.arange(n_buckets)*width
+    low = np.append(y, np.full(pad, np.inf)).reshape(n_buckets, width).argmin(axis=1)
+    high = np.append(y, np.full(pad, -np.inf)).reshape(n_buckets, width).argmax(axis=1)
+    return np.unique(np.minimum(np.concatenate([[0, n - 1], start + low, start + high]), n - 1))
+
+
+def downsample(x: np.ndarray, y: np.ndarray, max_points: int, method: str = 'lttb') -> tuple:
+    """
+    Drops the points without value and reduces the series to at most max_points with 'lttb' or
+    'minmax' (None keeps every point).
+    """
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    valid = np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if method is None or not max_points:
+        return x, y
+    if method == 'lttb':
+        keep = lttb(x.astype(np.int64) if x.dtype.kind == 'M' else x, y, max_points)
+    elif method == 'minmax':
+        keep = minmax(y, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}', use 'lttb' or 'minmax'")
+    return x[keep], y[keep]
+
+
+def _columns(data) -> dict:
+    # orderbooks as columns (data.to_columns), converted once when given as a dict of orderbooks
+    return data if 'offsets' in data else dt.to_columns(data.items())
+
+
+def _mid_price(data) -> tuple:
+    """
+    Timestamps (datetime64) and mid-prices of the snapshots of an exchange, from its columns, a dict
+    of orderbooks or the snapshots table of a data.ResultsStore.
+    """
+    if isinstance(data, np.ndarray):
+        return data['timestamp'].astype('datetime64[ns]'), (data['bid'][:, 0] + data['ask'][:, 0]) * 0.5
+    columns = _columns(data)
+    bid, ask = dt.top_of_book(columns)
+    return columns['timestamp'].astype('datetime64[ns]'), (bid + ask) * 0.5
+
+
+def _render(method: str, kwargs: dict, image_format: str, include_plotlyjs: bool):
+    # builds one report figure and renders it (runs in a worker process)
+    fig = getattr(XemmVisualization, method)(**kwargs, show=False)
+    if image_format is None:
+        return fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
+    return fig.to_image(format=image_format)
+
+
 class XemmVisualization:
 
     @staticmethod
-    def orderbook_history(data: dict, title) -> go.Figure:
+    def orderbook_history(data: dict, title: str = 'Orderbook ', max_frames: int = 100,
+                          show: bool = True) -> go.Figure:
         """
         A visualization of an asset's orderbooks evolution through time.
+
+        The figure holds a single bar trace and one animation frame per plotted snapshot (bids in
+        blue, asks in red), so the HTML grows with the frames shown instead of one trace each.
         
         Parameters
         ----------
         data:(dict)
-            Dictionary containing orderbooks as values and timestamps as keys.
+            Dictionary containing orderbooks as values and timestamps as keys, or the orderbooks
+            stored as columns (data.to_columns, data.read_cacheOB).
         
         title:(str)
             String specifying the plot's title
+
+        max_frames:(int)
+            Number of snapshots plotted, evenly spaced over the history (default = 100).
+
+        show:(bool)
+            Displays the figure, or returns it when False (default = True).
             
         Returns
         --------
             A bar chart showing an orderbook's structure through time.
         
         """
+        columns = _columns(data)
+        offsets, keys = columns['offsets'], columns['key']
+        shown = np.unique(np.linspace(0, len(keys) - 1, min(len(keys), max_frames)).astype(int))
 
-        def __ob_melt(data: pd.DataFrame ):
-            bid = data[['bid_size','bid']]
-            bid['bid_flag'] = ['bid']*bid.shape[0]
-            bid.rename(columns={'bid_size':'size',
-                                    'bid':'price',
-                                    'bid_flag':'type'}, inplace=True)
-
-            ask = data[['ask_size','ask']]
-            ask['ask_flag'] = ['ask']*ask.shape[0]
-            ask.rename(columns={'ask_size':'size',
-                                    'ask':'price',
-                                    'ask_flag':'type'}, inplace=True)
-
-            ob = bid.append(ask, ignore_index=True).dropna()
-            return ob
-    
-        # Create figure
-        fig = go.Figure()
-
-        # Add traces, one for each slider step
-        for time in range(0, len(list(data.keys())[:100])):
-            dff = __ob_melt(data[list(data.keys())[time]])
-            dff.reset_index(drop=True, inplace=True)
-            fig.add_trace(go.Bar(x=dff['price'], y=dff['size'], 
-            marker_color= ['red' if (dff['type'][i] == 'ask') else 
-            'blue' for i in range(len(dff['type']))], width = 0.4))
-        
+        frames = []
+        for i in shown:
+            lo, hi = offsets[i], offsets[i+1]
+            price = np.concatenate([columns['bid'][lo:hi], columns['ask'][lo:hi]])
+            size = np.concatenate([columns['bid_size'][lo:hi], columns['ask_size'][lo:hi]])
+            side = np.repeat([0, 1], hi - lo)
+            valid = np.isfinite(price)
+            price, size, side = price[valid], size[valid], side[valid]
+            bar = go.Bar(x=price, y=size, width=0.4,
+                         marker=dict(color=side, colorscale=[[0, 'blue'], [1, 'red']], cmin=0, cmax=1))
+            layout = dict(title_text=title + str(keys[i]))
+            if len(price):
+                layout.update(xaxis_range=[price.min() - 1, price.max() + 1], yaxis_range=[0, size.max()*1.05])
+            frames.append(go.Frame(data=[bar], layout=layout, name=str(i)))
 
-        
-        # Create and add slider
-        steps = []
-        for i in range(len(fig.data)):
-            step = dict(
-                method="update",
-                args=[{"visible": [False] * len(fig.data)},
-                    {"title": title + str(i)}],  # layout attribute
-            )
-            step["args"][0]["visible"][i] = True  # Toggle i'th trace to "visible"
-            steps.append(step)
-
-        sliders = [dict(
-            active = 0,
-            currentvalue={"prefix": "Frequency: "},
-            pad={"t": len(list(data.keys())[:100])},
-            steps=steps
-        )]
-
-        fig.update_layout(
-            sliders=sliders
-        )
-        fig.data[0].visible = True
-        return fig.show()
+        # Create figure with the first frame and a slider over the rest
+        fig = go.Figure(data=frames[0].data if frames else [], layout=frames[0].layout if frames else None,
+                        frames=frames)
+        steps = [dict(method='animate', label=str(keys[i]),
+                      args=[[frame.name], {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': True},
+                                           'transition': {'duration': 0}}])
+                 for i, frame in zip(shown, frames)]
+        fig.update_layout(sliders=[dict(active=0, currentvalue={"prefix": "Orderbook: "}, steps=steps)])
+        return fig.show() if show else fig
     
     @staticmethod
     def plot_mid(xemm: dict, origin: dict, destination: dict, 
-                 fiat_hist_dest: list, fiat_hist_origin: list) -> go.Figure:
+                 fiat_hist_dest: list, fiat_hist_origin: list,
+                 max_points: int = 2000, method: str = 'lttb', show: bool = True) -> go.Figure:
         """
         Plots the mid-price of the XEMM orderbook against the origin and destination ones.
 
+        The mid-prices are computed at once from the top of book arrays, downsampled and drawn with
+        WebGL, so runs of a day or more render in seconds.
+
         Parameters:
         -----------
-            xemm: Product orderbook of the XEMM implementation (dict).
-            origin: Origin orderbook (dict).
-            destination: Destination orderbook (dict).
+            xemm: Product orderbook of the XEMM implementation (dict), or the 'snapshots' table of
+              the results, which holds every snapshot when the orderbooks are sampled (np.ndarray).
+            origin: Origin orderbook (dict), or its columns (data.to_columns).
+            destination: Destination orderbook (dict), or its columns (data.to_columns).
             fiat_hist_dest: Destination balance per orderbook (list).
             fiat_hist_origin: Origin balance per orderbook (list).
+            max_points: Points per series after downsampling (int) (default = 2000).
+            method: Downsampling method, 'lttb', 'minmax' or None for every point (str).
+            show: Displays the figure, or returns it when False (bool) (default = True).
 
         Returns:
         --------
             Scatter plot.
         """
-        def __mid_price(data: dict) -> list:
-            ob_ts = list(data.keys())
-            mid = [(data[ob_ts[i]]['ask'][0] + data[ob_ts[i]]['bid'][0]) * 0.5 for i in range(0, len(ob_ts))]
-            return mid
-
-        origin = __mid_price(origin)
-        xemm = __mid_price(xemm)
-        destination = __mid_price(destination)[0:len(origin)]
+        origin_ts, origin_mid = _mid_price(origin)
+        xemm_ts, xemm_mid = _mid_price(xemm)
+        dest_ts, dest_mid = _mid_price(destination)
+        if len(origin_ts):
+            dest_mid = np.where(dest_ts <= origin_ts[-1], dest_mid, np.nan)
+
         fig = make_subplots(specs=[[{'secondary_y': True}]])
-        fig.add_trace(go.Scatter(name = 'Origin orderbook', y = origin, marker_color = 'blue'), secondary_y=False)
-        fig.add_trace(go.Scatter(name = 'XEMM orderbook', y = xemm, marker_color = 'green'), secondary_y=False)
-        fig.add_trace(go.Scatter(name = 'Destination orderbook', y = destination, marker_color = 'grey'), secondary_y=False)
+        for name, ts, mid, color in [('Origin orderbook', origin_ts, origin_mid, 'blue'),
+                                     ('XEMM orderbook', xemm_ts, xemm_mid, 'green'),
+                                     ('Destination orderbook', dest_ts, dest_mid, 'grey')]:
+            x, y = downsample(ts, mid, max_points, method)
+            fig.add_trace(go.Scattergl(name = name, x = x, y = y, mode = 'lines', marker_color = color),
+                          secondary_y=False)
         fig.update_layout(autosize = False, width = 900, height = 800, title_text = f'Mid-price comparison')
-        fig.update_xaxes(title_text = 'Number of orderbook')
+        fig.update_xaxes(title_text = 'Time')
         fig.update_yaxes(title_text = 'Mid-price', secondary_y=False)
-        return fig.show()
+        return fig.show() if show else fig
         
     @staticmethod
-    def cash_balances(fiat_bal_origin: float, fiat_bal_dest: float) -> go.Figure:
+    def cash_balances(fiat_bal_origin: float, fiat_bal_dest: float, show: bool = True) -> go.Figure:
         """
         Plots the cash balances.
 
@@ -129,6 +220,7 @@ class XemmVisualization:
         -----------
             fiat_bal_origin: Origin orderbook cash balance (float).
             fiat_bal_dest: Destination orderbook cash balance (float).
+            show: Displays the figure, or returns it when False (bool) (default = True).
 
         Returns:
         --------
@@ -140,10 +232,10 @@ class XemmVisualization:
               go.Bar(name = 'Destination balance', y = [fiat_bal_dest], marker_color = 'purple')])
         fig.update_layout(autosize = False, width = 900, height = 500, title_text = f'XEMM cash balance comparison')
         fig.update_yaxes(title_text = '$')
-        return fig.show()
+        return fig.show() if show else fig
     
     @staticmethod
-    def tokens_balances(token_bal_origin: float, token_bal_dest: float) -> go.Figure:
+    def tokens_balances(token_bal_origin: float, token_bal_dest: float, show: bool = True) -> go.Figure:
         """
         Plots the token balances.
 
@@ -151,6 +243,7 @@ class XemmVisualization:
         -----------
             token_bal_origin: Origin orderbook token balance (float).
             token_bal_dest: Destination orderbook token balance (float).
+            show: Displays the figure, or returns it when False (bool) (default = True).
 
         Returns:
         --------
@@ -162,10 +255,10 @@ class XemmVisualization:
               go.Bar(name = 'Destination balance', y = [token_bal_dest], marker_color = 'cyan')])
         fig.update_layout(autosize = False, width = 900, height = 500, title_text = f'XEMM token balance comparison')
         fig.update_yaxes(title_text = 'Tokens')
-        return fig.show()
+        return fig.show() if show else fig
 
     @staticmethod
-    def fees_comparison(fees_origin: list, fees_dest: list) -> go.Figure:
+    def fees_comparison(fees_origin: list, fees_dest: list, show: bool = True) -> go.Figure:
         """
         Plots the accumulated fees of the origin and destination orderbooks.
 
@@ -173,6 +266,7 @@ class XemmVisualization:
         -----------
             fees_origin: Origin orderbook accumulated fees (list).
             fees_dest: Destination orderbook accumulated fees (list).
+            show: Displays the figure, or returns it when False (bool) (default = True).
 
         Returns:
         --------
@@ -184,24 +278,93 @@ class XemmVisualization:
               go.Bar(name = 'Destination accumulated fees', y = [-sum(fees_dest)], marker_color = 'orange')])
         fig.update_layout(autosize = False, width = 900, height = 500, title_text = f'Accumulated fees comparison')
         fig.update_yaxes(title_text = '$')
-        return fig.show()
+        return fig.show() if show else fig
     
     @staticmethod
-    def plot_exposure(exposure_ts):
+    def plot_exposure(exposure_ts, max_points: int = 2000, method: str = 'lttb', show: bool = True):
         """
         Plots a time series showing the net exposure held throughout the time period.
         
         Parameters
         ----------
             exposure_ts: Array containig the net token exposure timestamp.
+            max_points: Points after downsampling (int) (default = 2000).
+            method: Downsampling method, 'lttb', 'minmax' or None for every point (str).
+            show: Displays the figure, or returns it when False (bool) (default = True).
             
         Returns
         -------
             Scatter plot.
         """
+        x, y = downsample(np.arange(len(exposure_ts)), exposure_ts, max_points, method)
         fig = go.Figure(data =
-              go.Scatter(name = 'BTC exposure', y = exposure_ts, marker_color = 'orange')) 
+              go.Scattergl(name = 'BTC exposure', x = x, y = y, mode = 'lines', marker_color = 'orange')) 
         fig.update_layout(autosize = False, width = 900, height = 500, title_text = 'Net Token Exposure')
         fig.update_yaxes(title_text = 'Token amount')
 
-        return fig.show()
\ No newline at end of file
+        return fig.show() if show else fig
+
+    @staticmethod
+    def report(results: dict, origin: dict, destination: dict, file_path: str, image_format: str = None,
+               max_workers: int = None, max_points: int = 2000, max_frames: int = 100,
+               title: str = 'XEMM report') -> list:
+        """
+        Headless report: builds every figure (mid-price, cash, tokens, fees, exposure and the XEMM
+        orderbook history) from one results dictionary and writes them to disk without showing them.
+        The figures are independent, so they are built and rendered in parallel processes.
+
+        Parameters:
+        -----------
+            results: Output of XEMM.cross_exchange_market_making (dict).
+            origin: Origin orderbook (dict), or its columns (data.to_columns, data.read_cacheOB).
+            destination: Destination orderbook (dict), or its columns.
+            file_path: HTML file holding every figure and plotly.js, so it opens offline; or the
+              directory of the images when image_format is given (str).
+            image_format: 'png', 'svg', 'pdf', ... to write one static image per figure, which needs
+              the kaleido package (str) (default = None, HTML).
+            max_workers: Processes rendering the figures, 1 to render them in this process, e.g.
+              inside the workers of a parameter sweep (int) (default = number of figures or cores).
+            max_points: Points per time series after downsampling (int) (default = 2000).
+            max_frames: Orderbooks in the orderbook history (int) (default = 100).
+            title: Title of the HTML page (str).
+
+        Returns:
+        --------
+            Paths of the written files (list).
+        """
+        figures = {
+            'mid': ('plot_mid', dict(xemm=results['snapshots'], origin=_columns(origin),
+                                     destination=_columns(destination), fiat_hist_dest=None,
+                                     fiat_hist_origin=None, max_points=max_points)),
+            'cash': ('cash_balances', dict(fiat_bal_origin=results['fiat_bal_origin'],
+                                           fiat_bal_dest=results['fiat_bal_dest'])),
+            'tokens': ('tokens_balances', dict(token_bal_origin=results['token_bal_origin'],
+                                               token_bal_dest=results['token_bal_dest'])),
+            'fees': ('fees_comparison', dict(fees_origin=results['fees_origin'], fees_dest=results['fees_dest'])),
+            'exposure': ('plot_exposure', dict(exposure_ts=results['token_exposure'], max_points=max_points))}
+        if results['ob_xemm']:
+            figures['orderbook'] = ('orderbook_history', dict(data=results['ob_xemm'], title='XEMM orderbook ',
+                                                              max_frames=max_frames))
+
+        # plotly.js is embedded once, with the first figure
+        jobs = [(method, kwargs, image_format, i == 0) for i, (method, kwargs) in enumerate(figures.values())]
+        max_workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+        if max_workers == 1:
+            rendered = [_render(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                rendered = list(executor.map(_render, *zip(*jobs)))
+
+        if image_format is None:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                        f'</head><body><h1>{html.escape(title)}</h1>{"".join(rendered)}</body></html>')
+            return [file_path]
+
+        os.makedirs(file_path, exist_ok=True)
+        paths = []
+        for name, image in zip(figures, rendered):
+            paths.append(os.path.join(file_path, f'{name}.{image_format}'))
+            with open(paths[-1], 'wb') as f:
+                f.write(image)
+        return paths